@@ -0,0 +1,83 @@
+"""Асинхронный путь чтения для ASGI.
+
+Под ASGI Django выполняет синхронные вьюхи в одном потоке на процесс,
+поэтому медленный запрос к базе задерживает всех остальных клиентов
+воркера. Асинхронный ORM Django 4.2 устроен так же: ``aget`` и
+``async for`` отправляют каждый запрос в тот же единственный поток.
+Здесь GET-запросы горячих эндпоинтов выполняются целиком в ограниченном
+пуле потоков, у каждого из которых своё соединение с базой, а цикл
+событий тем временем обслуживает остальных клиентов. Ответы совпадают
+с синхронными: работают те же вьюсеты, кэши, ETag и ограничения частоты.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern
+
+ASYNC_READ_ROUTES = frozenset((
+    'tag-list', 'tag-detail',
+    'ingridients-list', 'ingridients-detail',
+    'recipes-list', 'recipes-detail',
+    'users-subscriptions',
+))
+READ_METHODS = ('GET', 'HEAD')
+
+executor = None
+
+
+def get_executor():
+    """Пул потоков чтения текущего процесса."""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_READ_THREADS,
+            thread_name_prefix='async-read',
+        )
+    return executor
+
+
+def run_read(view, request, args, kwargs):
+    """Выполнить и отрендерить вьюху в потоке пула."""
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(sync_view):
+    """Асинхронная обёртка: чтение в пуле, запись как обычно."""
+    write_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method not in READ_METHODS:
+            return await write_view(request, *args, **kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(), context.run,
+            run_read, sync_view, request, args, kwargs,
+        )
+
+    view.csrf_exempt = getattr(sync_view, 'csrf_exempt', False)
+    view.cls = getattr(sync_view, 'cls', None)
+    view.actions = getattr(sync_view, 'actions', None)
+    view.initkwargs = getattr(sync_view, 'initkwargs', None)
+    return view
+
+
+def async_read_urls(urls):
+    """Заменить вьюхи горячих маршрутов роутера асинхронными."""
+    return [
+        URLPattern(
+            url.pattern, async_read_view(url.callback),
+            url.default_args, url.name,
+        ) if url.name in ASYNC_READ_ROUTES else url
+        for url in urls
+    ]
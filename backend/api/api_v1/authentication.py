@@ -0,0 +1,175 @@
+"""Аутентификация по токену с кэшем найденных токенов и пользователей.
+
+Id владельца токена кэшируется в два уровня: ограниченный LRU в памяти
+процесса с коротким сроком жизни и общий кэш Django. Удаление токена
+сбрасывает оба уровня; в других процессах локальная запись доживает не
+дольше ``TOKEN_LOCAL_CACHE_TIMEOUT``.
+
+Строка пользователя без хэша пароля кэшируется только в общем кэше:
+сохранение и удаление пользователя, а также ``update()`` его строк,
+включая счётчики и ``is_active``, сбрасывают запись после фиксации
+транзакции. С кэшем в памяти процесса сброс не дошёл бы до других
+воркеров, поэтому там пользователь читается из базы по первичному ключу.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from backend.metrics import record_cache
+
+TOKEN_CACHE_KEY = 'auth-token:{}'
+USER_CACHE_KEY = 'auth-user:{}'
+UNCACHED_USER_FIELDS = ('password',)
+
+
+def token_digest(key):
+    """Отпечаток токена, чтобы не хранить его в кэше открытым."""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class LocalTokenCache:
+    """Потокобезопасный LRU с ограничением по размеру и времени."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, digest):
+        """Id владельца токена из памяти или None."""
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires < time.monotonic():
+                del self.entries[digest]
+                return None
+            self.entries.move_to_end(digest)
+        return user_id
+
+    def set(self, digest, user_id):
+        """Запомнить токен, вытеснив самые старые записи."""
+        with self.lock:
+            self.entries[digest] = (
+                user_id,
+                time.monotonic() + settings.TOKEN_LOCAL_CACHE_TIMEOUT,
+            )
+            self.entries.move_to_end(digest)
+            while len(self.entries) > settings.TOKEN_LOCAL_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, digests):
+        """Забыть токены."""
+        with self.lock:
+            for digest in digests:
+                self.entries.pop(digest, None)
+
+
+local_tokens = LocalTokenCache()
+
+
+def users_cached():
+    """Кэшируются ли строки пользователей."""
+    return bool(settings.TOKEN_SHARED_CACHE_TIMEOUT) and settings.SHARED_CACHE
+
+
+def cache_user(user):
+    """Положить строку пользователя в общий кэш."""
+    cache.set(
+        USER_CACHE_KEY.format(user.pk),
+        {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields
+            if field.attname not in UNCACHED_USER_FIELDS
+        },
+        settings.TOKEN_SHARED_CACHE_TIMEOUT,
+    )
+
+
+def get_user(user_id):
+    """Пользователь из общего кэша, а при промахе — из базы.
+
+    У восстановленного из кэша пользователя пароль отложен и читается
+    из базы при первом обращении.
+    """
+    model = get_user_model()
+    if not users_cached():
+        return model.objects.filter(pk=user_id).first()
+    values = cache.get(USER_CACHE_KEY.format(user_id))
+    record_cache('auth_user', hits=values is not None,
+                 misses=values is None)
+    if values is not None:
+        return model.from_db(
+            DEFAULT_DB_ALIAS, list(values), list(values.values())
+        )
+    user = model.objects.filter(pk=user_id).first()
+    if user is not None:
+        cache_user(user)
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` без запросов к базе для известных токенов."""
+
+    def authenticate_credentials(self, key):
+        """Найти владельца токена в кэше, а при промахе — в базе."""
+        digest = token_digest(key)
+        user_id = local_tokens.get(digest)
+        record_cache('auth_token_local', hits=user_id is not None,
+                     misses=user_id is None)
+        if user_id is None and settings.TOKEN_SHARED_CACHE_TIMEOUT:
+            user_id = cache.get(TOKEN_CACHE_KEY.format(digest))
+            record_cache('auth_token_shared', hits=user_id is not None,
+                         misses=user_id is None)
+            if user_id is not None:
+                local_tokens.set(digest, user_id)
+        if user_id is None:
+            user, token = super().authenticate_credentials(key)
+            local_tokens.set(digest, user.pk)
+            if settings.TOKEN_SHARED_CACHE_TIMEOUT:
+                cache.set(
+                    TOKEN_CACHE_KEY.format(digest), user.pk,
+                    settings.TOKEN_SHARED_CACHE_TIMEOUT,
+                )
+            if users_cached():
+                cache_user(user)
+            return user, token
+        user = get_user(user_id)
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, Token(key=key, user=user)
+
+
+def invalidate_tokens(keys):
+    """Сбросить токены в обоих уровнях кэша после фиксации транзакции."""
+    digests = [token_digest(key) for key in keys]
+    if not digests:
+        return
+
+    def invalidate():
+        local_tokens.delete(digests)
+        cache.delete_many(
+            [TOKEN_CACHE_KEY.format(digest) for digest in digests]
+        )
+
+    local_tokens.delete(digests)
+    transaction.on_commit(invalidate)
+
+
+def invalidate_users(pks):
+    """Сбросить строки пользователей в кэше сейчас и после фиксации."""
+    keys = [USER_CACHE_KEY.format(pk) for pk in pks]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
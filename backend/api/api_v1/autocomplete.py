@@ -0,0 +1,111 @@
+"""Индекс автодополнения ингредиентов в памяти процесса.
+
+Индекс строится из таблицы ингредиентов один раз на воркер и
+перестраивается, когда меняется версия справочника в кэше или истекает
+``INGREDIENT_INDEX_TTL``. Поиск по индексу не обращается к базе.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.metrics import record_cache
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient-index-version'
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(value):
+    """Привести название к виду для сравнения."""
+    return ' '.join(value.casefold().replace('ё', 'е').split())
+
+
+class IngredientIndex:
+    """Отсортированные названия ингредиентов с поиском по префиксу."""
+
+    def __init__(self, rows, version):
+        items = sorted(
+            (normalize(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit in rows
+        )
+        self.version = version
+        self.built_at = time.monotonic()
+        self.keys = [item[0] for item in items]
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in items
+        ]
+        self.haystack = '\n'.join(self.keys)
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+
+    def search(self, query, limit):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        query = normalize(query)
+        if not query:
+            return self.items[:limit]
+        found = []
+        position = bisect_left(self.keys, query)
+        while (
+            len(found) < limit
+            and position < len(self.keys)
+            and self.keys[position].startswith(query)
+        ):
+            found.append(position)
+            position += 1
+        start = self.haystack.find(query)
+        while start != -1 and len(found) < limit:
+            position = bisect_right(self.offsets, start) - 1
+            if start != self.offsets[position]:
+                found.append(position)
+            if position + 1 == len(self.offsets):
+                break
+            start = self.haystack.find(query, self.offsets[position + 1])
+        return [self.items[position] for position in found]
+
+
+def get_index():
+    """Актуальный индекс текущего процесса."""
+    global _index
+    version = cache.get(INGREDIENT_INDEX_VERSION_KEY)
+    index = _index
+    if (
+        index is not None
+        and index.version == version
+        and time.monotonic() - index.built_at < settings.INGREDIENT_INDEX_TTL
+    ):
+        record_cache('ingredient_index', hits=1)
+        return index
+    with _lock:
+        if _index is index:
+            from recipes.models import Ingredient
+
+            record_cache('ingredient_index', misses=1)
+
+            _index = IngredientIndex(
+                Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ),
+                version,
+            )
+        return _index
+
+
+def search_ingredients(query, limit):
+    """Найти ингредиенты для автодополнения."""
+    return get_index().search(query, limit)
+
+
+def invalidate_ingredient_index():
+    """Сменить версию справочника после фиксации транзакции."""
+    transaction.on_commit(
+        lambda: cache.set(INGREDIENT_INDEX_VERSION_KEY, time.time_ns(), None)
+    )
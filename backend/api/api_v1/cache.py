@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.metrics import record_cache
+
+RECIPE_FRAGMENT_KEY = 'recipe-fragment:{}:{}'
+TAG_IDS_KEY = 'tag-ids-by-slug'
+
+
+def recipe_fragment_key(recipe):
+    """Ключ фрагмента по id рецепта и его версии."""
+    return RECIPE_FRAGMENT_KEY.format(
+        recipe.id, recipe.updated_at.timestamp()
+    )
+
+
+def get_recipe_fragments(recipes):
+    """Получить закэшированные фрагменты рецептов одним запросом к кэшу."""
+    keys = {recipe_fragment_key(recipe): recipe.id for recipe in recipes}
+    cached = cache.get_many(keys)
+    record_cache(
+        'recipe_fragments', hits=len(cached), misses=len(keys) - len(cached)
+    )
+    return {keys[key]: fragment for key, fragment in cached.items()}
+
+
+def set_recipe_fragments(recipes, fragments):
+    """Сохранить фрагменты рецептов, переданные словарём {id: данные}."""
+    cache.set_many(
+        {
+            recipe_fragment_key(recipe): fragments[recipe.id]
+            for recipe in recipes
+        },
+        timeout=settings.RECIPE_FRAGMENT_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_recipes(recipes):
+    """Сбросить текущие фрагменты рецептов после фиксации транзакции.
+
+    Изменение рецепта и так меняет его версию, удаление лишь освобождает
+    место в кэше.
+    """
+    keys = [recipe_fragment_key(recipe) for recipe in recipes]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_tag_ids():
+    """Словарь слаг -> id тегов из кэша."""
+    from recipes.models import Tags
+
+    tag_ids = cache.get(TAG_IDS_KEY)
+    if tag_ids is not None:
+        record_cache('tag_ids', hits=1)
+        return tag_ids
+    record_cache('tag_ids', misses=1)
+    tag_ids = dict(Tags.objects.values_list('slug', 'id'))
+    cache.set(TAG_IDS_KEY, tag_ids, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def resolve_tag_slugs(slugs):
+    """Словарь слаг -> id для переданных слагов; неизвестных в нём нет.
+
+    Кэш у каждого процесса свой и может не знать о теге, созданном в
+    другом воркере, поэтому слаги, которых нет в кэше, ищутся в базе.
+    """
+    from recipes.models import Tags
+
+    tag_ids = get_tag_ids()
+    found = {slug: tag_ids[slug] for slug in slugs if slug in tag_ids}
+    missing = set(slugs) - found.keys()
+    if missing:
+        found.update(
+            Tags.objects.filter(slug__in=missing).values_list('slug', 'id')
+        )
+    return found
+
+
+def invalidate_tag_ids():
+    """Сбросить закэшированный словарь тегов."""
+    transaction.on_commit(lambda: cache.delete(TAG_IDS_KEY))
@@ -1,2 +1,5 @@
 MIN_VALIDATED = 1
 MAX_VALIDATED = 32000
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 100
+SHOPPING_LIST_CHUNK_SIZE = 500
@@ -1,31 +1,98 @@
+from api.api_v1.cache import get_tag_ids, resolve_tag_slugs
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filter
-
-from users.models import MyUser
 from recipes.models import Recipe
+from users.models import MyUser
+
+
+def tag_choices():
+    """Слаги тегов из кэша для формы фильтра."""
+    return [(slug, slug) for slug in get_tag_ids()]
+
+
+class TagSlugField(forms.MultipleChoiceField):
+    """Слаги тегов, проверенные по кэшу, а неизвестные ему — по базе."""
+
+    def validate(self, value):
+        """Ошибка для первого слага, которого нет ни в кэше, ни в базе."""
+        if self.required and not value:
+            raise forms.ValidationError(
+                self.error_messages['required'], code='required'
+            )
+        known = resolve_tag_slugs(value)
+        for slug in value:
+            if slug not in known:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': slug},
+                )
+
+
+class TagSlugFilter(filter.MultipleChoiceFilter):
+    """Фильтр по слагам тегов."""
+
+    field_class = TagSlugField
+
+
+class StableOrderingFilter(filter.OrderingFilter):
+    """Сортировка с id последним ключом, чтобы порядок был однозначным.
+
+    Иначе строки с одинаковым значением поля могут переезжать между
+    страницами при OFFSET-пагинации.
+    """
+
+    def filter(self, qs, value):
+        """Добавить id в направлении последнего поля сортировки."""
+        if not value:
+            return qs
+        ordering = [self.get_ordering_value(param) for param in value]
+        tie_breaker = '-id' if ordering[-1].startswith('-') else 'id'
+        return qs.order_by(*ordering, tie_breaker)
 
 
 class RecipeFilter(filter.FilterSet):
     """Катомный фильтр для рецепта."""
 
-    tags = filter.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = TagSlugFilter(
+        choices=tag_choices,
+        method='filter_tags',
+        distinct=False,
+    )
     author = filter.ModelChoiceFilter(queryset=MyUser.objects.all())
     is_favorited = filter.BooleanFilter(method='filter_is_favorited')
+    search = filter.CharFilter(method='filter_search')
     is_in_shopping_cart = filter.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    ordering = StableOrderingFilter(fields=('favorites_count', 'pub_date'))
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags',)
 
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по тегам через EXISTS, без JOIN и DISTINCT."""
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tags_id__in=list(resolve_tag_slugs(value).values()),
+            )
+        ))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию."""
+        return queryset.search(value)
+
     def filter_is_favorited(self, queryset, name, value):
         """Фильтр по избранному."""
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(favorited_by__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Фильтр по списку покупок."""
         if value and not self.request.user.is_anonymous:
-            return queryset.filter(cart__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
@@ -0,0 +1,119 @@
+import logging
+from contextlib import ExitStack
+from http import HTTPStatus
+
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import md5
+from django.utils.http import http_date, quote_etag
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMixin:
+    """Контроль количества SQL-запросов на действие в режиме DEBUG.
+
+    В ``query_budget`` задаётся число запросов для действия вьюсета без
+    фильтров, каждый переданный фильтр ``filterset_class`` добавляет
+    ``filter_query_budget``. Учитываются запросы ко всем базам, включая
+    реплики. О превышении пишется предупреждение со списком запросов,
+    ответ при этом не меняется.
+    """
+
+    query_budget = {}
+    filter_query_budget = 1
+
+    def get_query_budget(self):
+        """Бюджет текущего действия с учётом переданных фильтров."""
+        budget = self.query_budget.get(getattr(self, 'action', None))
+        filterset_class = getattr(self, 'filterset_class', None)
+        if budget is None or filterset_class is None:
+            return budget
+        params = self.request.query_params
+        return budget + self.filter_query_budget * sum(
+            name in params for name in filterset_class.base_filters
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        """Выполнить запрос и сверить число запросов с бюджетом."""
+        if not settings.DEBUG or not self.query_budget:
+            return super().dispatch(request, *args, **kwargs)
+        executed = []
+
+        def record(execute, sql, params, many, context):
+            executed.append((context['connection'].alias, sql))
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(record)
+                )
+            response = super().dispatch(request, *args, **kwargs)
+        budget = self.get_query_budget()
+        if (
+            budget is not None
+            and response.status_code < 400
+            and len(executed) > budget
+        ):
+            logger.warning(
+                '%s.%s: %d запросов при бюджете %d.\n%s',
+                self.__class__.__name__, self.action, len(executed), budget,
+                '\n'.join(f'[{alias}] {sql}' for alias, sql in executed),
+            )
+        return response
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve.
+
+    ``get_etag_state`` возвращает значение, однозначно описывающее ответ
+    действия, или None, если условный ответ невозможен. ETag строится по
+    нему и по адресу запроса, а ответ 304 отдаётся до сериализации.
+    """
+
+    def get_etag_state(self):
+        """Состояние, от которого зависит ответ."""
+        return None
+
+    def get_last_modified(self, state):
+        """Время последнего изменения ответа, если оно известно."""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        """Список с поддержкой If-None-Match."""
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """Объект с поддержкой If-None-Match."""
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        """Ответить 304, если ETag клиента совпадает с текущим."""
+        state = self.get_etag_state()
+        if state is None:
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(md5(
+            repr((request.get_host(), request.get_full_path(), state))
+            .encode(),
+            usedforsecurity=False,
+        ).hexdigest())
+        last_modified = self.get_last_modified(state)
+        if last_modified is not None:
+            last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
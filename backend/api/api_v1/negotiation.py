@@ -0,0 +1,10 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """Параметр format выбирает формат файла, а не рендерер DRF."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        """Ответы с ошибками всегда отдаются первым рендерером."""
+        renderer = renderers[0]
+        return renderer, renderer.media_type
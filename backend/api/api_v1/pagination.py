@@ -1,4 +1,8 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
 
 class CustomPagination(PageNumberPagination):
@@ -6,3 +10,116 @@ class CustomPagination(PageNumberPagination):
 
     page_size = 6
     page_size_query_param = "limit"
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация ленты рецептов по ключу (pub_date, id).
+
+    В курсор записываются дата и id крайнего рецепта страницы, а
+    следующая страница выбирается условием по обоим полям, без OFFSET,
+    даже если у многих рецептов одинаковая дата публикации.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Страница рецептов после или перед позицией курсора."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        queryset = queryset.order_by('-pub_date', '-id')
+        if cursor is not None:
+            pub_date, pk = self.parse_position(cursor.position)
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk)
+                ).order_by('pub_date', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+                )
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def parse_position(self, position):
+        """Дата и id рецепта из позиции курсора."""
+        try:
+            pub_date, pk = position.split('|')
+            pub_date, pk = parse_datetime(pub_date), int(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def link(self, recipe, reverse):
+        """Адрес страницы после или перед рецептом."""
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=reverse,
+            position=f'{recipe.pub_date.isoformat()}|{recipe.pk}',
+        ))
+
+    def get_next_link(self):
+        """Адрес следующей страницы."""
+        if not self.has_next or not self.page:
+            return None
+        return self.link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        """Адрес предыдущей страницы."""
+        if not self.has_previous or not self.page:
+            return None
+        return self.link(self.page[0], reverse=True)
+
+
+class RecipePagination(PageNumberPagination):
+    """Постраничная пагинация с курсорным режимом по запросу.
+
+    Курсорный режим включается параметром ``pagination=cursor`` или
+    переданным курсором и не требует COUNT и OFFSET по всей выборке.
+    Курсор привязан к ключу (pub_date, id), поэтому ``ordering`` в
+    этом режиме отклоняется.
+    """
+
+    mode_query_param = 'pagination'
+    ordering_query_param = 'ordering'
+    cursor_pagination_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Выбрать режим пагинации и получить страницу."""
+        self.cursor_paginator = None
+        cursor_paginator = self.cursor_pagination_class()
+        if (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or cursor_paginator.cursor_query_param in request.query_params
+        ):
+            if self.ordering_query_param in request.query_params:
+                raise ValidationError({
+                    self.ordering_query_param: (
+                        'Сортировка недоступна в курсорном режиме.'
+                    )
+                })
+            self.cursor_paginator = cursor_paginator
+            return cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """Ответ в формате выбранного режима."""
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,12 @@
+from rest_framework.renderers import JSONRenderer
+
+from backend.profiling import profile_section
+
+
+class ProfiledJSONRenderer(JSONRenderer):
+    """JSON-рендерер, учитывающий своё время в профиле запроса."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Отрендерить ответ, замерив время."""
+        with profile_section('render'):
+            return super().render(data, accepted_media_type, renderer_context)
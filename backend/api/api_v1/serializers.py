@@ -1,10 +1,18 @@
-from django.shortcuts import get_object_or_404
+import json
+
+from api.api_v1.cache import (get_recipe_fragments, get_tag_ids,
+                              invalidate_recipes, set_recipe_fragments)
 from api.api_v1.constants import MAX_VALIDATED, MIN_VALIDATED
+from api.api_v1.uploads import StreamingImageField
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
+from recipes import shopping_totals
+from recipes.images import variant_urls
 from recipes.models import (Ingredient, IngredientAmount, Recipe,
-                            RecipeIngredient, Tags)
+                            RecipeIngredient, ShoppingListItem, Tags)
 from rest_framework import serializers
-from users.models import Follow, MyUser
+from users.models import MyUser
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -24,27 +32,82 @@ class IngtedienSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
-    """Пользователь."""
+class ImageVariantsField(serializers.Field):
+    """Адреса уменьшенных копий изображения.
+
+    Без запроса в контексте адреса относительные, как у ``ImageField``.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        """Копии вида {ширина: {формат: url}}."""
+        return absolute_variants(
+            self.context.get('request'),
+            variant_urls(instance, self.image_field),
+        )
+
+
+def absolute_variants(request, variants):
+    """Сделать адреса копий абсолютными, если известен запрос."""
+    if request is None:
+        return variants
+    return {
+        width: {
+            fmt: request.build_absolute_uri(url)
+            for fmt, url in formats.items()
+        }
+        for width, formats in variants.items()
+    }
+
+
+class UserInfoSerializer(serializers.ModelSerializer):
+    """Публичные данные пользователя без отметки подписки."""
 
-    is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.ImageField(read_only=True)
+    avatar_variants = ImageVariantsField('avatar')
 
     class Meta:
         model = MyUser
+        fields = (
+            'id', 'email', 'username', 'first_name', 'last_name', 'avatar',
+            'avatar_variants'
+        )
+
+
+class CustomUserSerializer(UserInfoSerializer):
+    """Пользователь."""
+
+    is_subscribed = serializers.SerializerMethodField()
+
+    class Meta(UserInfoSerializer.Meta):
         fields = (
             'id', 'email', 'username', 'first_name',
-            'last_name', 'is_subscribed', 'avatar'
+            'last_name', 'is_subscribed', 'avatar', 'avatar_variants'
         )
 
     def get_is_subscribed(self, obj):
         """Проверка подписки."""
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         if user.is_anonymous:
             return False
         return obj.followers.filter(user=user).exists()
 
 
+class UserProfileSerializer(CustomUserSerializer):
+    """Карточка пользователя со счётчиками."""
+
+    class Meta(CustomUserSerializer.Meta):
+        fields = CustomUserSerializer.Meta.fields + (
+            'recipes_count', 'followers_count'
+        )
+
+
 class SetPasswordSerializer(serializers.Serializer):
     """Смена пароля."""
 
@@ -87,17 +150,34 @@ class UserCreateSerializer(serializers.ModelSerializer):
 class UserAvatarAdd(serializers.ModelSerializer):
     """Добавление аватара."""
 
-    avatar = Base64ImageField()
+    avatar = StreamingImageField()
 
     class Meta:
         model = MyUser
         fields = ('avatar',)
 
 
+class LazyPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Первичный ключ без запроса к базе.
+
+    Существование объектов проверяет сериализатор рецепта одним запросом
+    на весь список.
+    """
+
+    def to_internal_value(self, data):
+        """Проверить только тип ключа."""
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
 class IngredientsinRecipeAmountSerializer(serializers.ModelSerializer):
     """Количество ингредиентов."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = LazyPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(
         min_value=MIN_VALIDATED,
         max_value=MAX_VALIDATED
@@ -122,8 +202,56 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class RecipeFragmentSerializer(serializers.ModelSerializer):
+    """Часть рецепта, не зависящая от пользователя.
+
+    Рендерится без запроса в контексте, поэтому ссылки на файлы
+    относительные и фрагмент можно хранить в кэше.
+    """
+
+    ingredients = IngredientInRecipeSerializer(
+        many=True,
+        source='amount_ingredient'
+    )
+    author = UserInfoSerializer(read_only=True)
+    tags = TagSerializer(read_only=True, many=True)
+    image = Base64ImageField()
+    image_variants = ImageVariantsField('image')
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id', 'tags', 'author', 'ingredients',
+            'name', 'image', 'image_variants', 'text', 'cooking_time'
+        )
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов из кэша фрагментов."""
+
+    def to_representation(self, data):
+        """Собрать страницу одним обращением к кэшу."""
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        fragments = get_recipe_fragments(recipes)
+        missing = [
+            recipe for recipe in recipes if recipe.id not in fragments
+        ]
+        if missing:
+            rendered = self.child.render_fragments(missing)
+            set_recipe_fragments(missing, rendered)
+            fragments.update(rendered)
+        return [
+            self.child.overlay(fragments[recipe.id], recipe)
+            for recipe in recipes
+        ]
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    """Чтение рецепта."""
+    """Чтение рецепта.
+
+    Общая часть берётся из кэша фрагментов, поверх неё накладываются
+    отметки текущего пользователя, аннотированные во вьюсете.
+    """
 
     ingredients = IngredientInRecipeSerializer(
         many=True,
@@ -131,40 +259,98 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     author = CustomUserSerializer(read_only=True)
     tags = TagSerializer(read_only=True, many=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+    favorites_count = serializers.IntegerField(read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField('image')
+
+    prefetch_plan = (
+        'author',
+        Prefetch(
+            'amount_ingredient',
+            queryset=IngredientAmount.objects.select_related('ingredient')
+        ),
+        'tags',
+    )
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients',
-            'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time'
+            'is_favorited', 'is_in_shopping_cart', 'favorites_count',
+            'name', 'image', 'image_variants', 'text', 'cooking_time'
         )
+        list_serializer_class = RecipeListSerializer
+
+    def render_fragments(self, recipes):
+        """Отрендерить фрагменты рецептов, которых нет в кэше."""
+        prefetch_related_objects(recipes, *self.prefetch_plan)
+        return {
+            recipe.id: RecipeFragmentSerializer(recipe).data
+            for recipe in recipes
+        }
+
+    def overlay(self, fragment, recipe):
+        """Дополнить фрагмент отметками текущего пользователя."""
+        request = self.context['request']
+        author = dict(fragment['author'])
+        author['is_subscribed'] = recipe.author_is_subscribed
+        if author['avatar']:
+            author['avatar'] = request.build_absolute_uri(author['avatar'])
+        author['avatar_variants'] = absolute_variants(
+            request, author['avatar_variants']
+        )
+        data = dict(fragment)
+        data.update(
+            author={
+                field: author[field]
+                for field in CustomUserSerializer.Meta.fields
+            },
+            image=request.build_absolute_uri(fragment['image']),
+            image_variants=absolute_variants(
+                request, fragment['image_variants']
+            ),
+            is_favorited=recipe.is_favorited,
+            is_in_shopping_cart=recipe.is_in_shopping_cart,
+            favorites_count=recipe.favorites_count,
+        )
+        return {field: data[field] for field in self.Meta.fields}
 
-    def get_is_favorited(self, obj):
-        """Проверка, добавлен ли рецепт в избранное текущим пользователем."""
-        user = self.context['request'].user
-        return (
-            not user.is_anonymous and obj.favorited_by.filter(
-                user=user).exists())
+    def to_representation(self, instance):
+        """Рецепт из кэша фрагментов."""
+        fragment = get_recipe_fragments([instance]).get(instance.id)
+        if fragment is None:
+            rendered = self.render_fragments([instance])
+            set_recipe_fragments([instance], rendered)
+            fragment = rendered[instance.id]
+        return self.overlay(fragment, instance)
 
-    def get_is_in_shopping_cart(self, obj):
-        """Добавление в список покупок."""
-        user = self.context['request'].user
-        return (not user.is_anonymous and obj.cart.filter(user=user).exists())
+
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Итог ингредиента в списке покупок."""
+
+    id = serializers.IntegerField(source='ingredient.id')
+    name = serializers.CharField(source='ingredient.name')
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit'
+    )
+    amount = serializers.IntegerField(source='total_amount')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """Запись рецепта."""
 
     ingredients = IngredientsinRecipeAmountSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = LazyPrimaryKeyRelatedField(
         queryset=Tags.objects.all(),
         many=True
     )
-    image = Base64ImageField()
+    image = StreamingImageField()
     cooking_time = serializers.IntegerField(
         min_value=MIN_VALIDATED,
         max_value=MAX_VALIDATED
@@ -177,28 +363,87 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             'text', 'cooking_time',
         )
 
+    def to_internal_value(self, data):
+        """Принять multipart-форму с составом рецепта в виде JSON."""
+        if hasattr(data, 'getlist'):
+            form = {key: data[key] for key in data}
+            if 'tags' in data:
+                form['tags'] = data.getlist('tags')
+            if 'ingredients' in data:
+                try:
+                    form['ingredients'] = json.loads(data['ingredients'])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {'ingredients': ['Ожидается JSON-массив.']}
+                    )
+            data = form
+        return super().to_internal_value(data)
+
+    def does_not_exist(self, field, pk):
+        """Текст ошибки о несуществующем объекте."""
+        return field.error_messages['does_not_exist'].format(pk_value=pk)
+
     def validate_tags(self, tags):
-        """Валидация тэгов."""
-        tags_data = self.initial_data.get('tags')
-        if tags_data is None:
+        """Валидация тэгов по закэшированному справочнику.
+
+        Кэш у каждого процесса свой и может не знать о новом теге,
+        поэтому неизвестные ему id проверяются одним запросом к базе.
+        """
+        if not tags:
             raise serializers.ValidationError('Нужен хотя бы один тег.')
-        for tag_id in tags_data:
-            if not Tags.objects.filter(id=tag_id).exists():
-                raise serializers.ValidationError('Тег не существует.')
+        known = set(get_tag_ids().values())
+        unknown = set(tags) - known
+        if unknown:
+            known.update(
+                Tags.objects.filter(id__in=unknown)
+                .values_list('id', flat=True)
+            )
+        field = self.fields['tags'].child_relation
+        missing = [
+            self.does_not_exist(field, tag_id)
+            for tag_id in tags if tag_id not in known
+        ]
+        if missing:
+            raise serializers.ValidationError(missing)
         return tags
 
     def validate_ingredients(self, ingredients):
-        """Валидация."""
+        """Валидация одним запросом на все ингредиенты."""
         if not ingredients:
             raise serializers.ValidationError('Нужен хотя бы один ингредиент.')
+        found = Ingredient.objects.in_bulk(
+            {item['id'] for item in ingredients}
+        )
+        field = self.fields['ingredients'].child.fields['id']
+        errors = [
+            {} if item['id'] in found
+            else {'id': [self.does_not_exist(field, item['id'])]}
+            for item in ingredients
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
         seen = set()
         for item in ingredients:
-            if item['id'].id in seen:
+            if item['id'] in seen:
                 raise serializers.ValidationError(
                     'Ингредиенты должны быть уникальны.')
-            seen.add(item['id'].id)
+            seen.add(item['id'])
+            item['id'] = found[item['id']]
         return ingredients
 
+    def save(self, **kwargs):
+        """Сохранить рецепт; 400, если тег или ингредиент удалили.
+
+        Между валидацией и записью тег или ингредиент могут удалить,
+        тогда внешний ключ нарушается при фиксации транзакции.
+        """
+        try:
+            return super().save(**kwargs)
+        except IntegrityError as error:
+            raise serializers.ValidationError(
+                'Тег или ингредиент был удалён, повторите запрос.'
+            ) from error
+
     def create_ingredients(self, ingredients, recipe):
         """Создание ингредиента."""
         ingredients_list = [IngredientAmount(
@@ -208,29 +453,73 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         ) for item in ingredients]
         IngredientAmount.objects.bulk_create(ingredients_list)
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта."""
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
+        MyUser.objects.filter(pk=recipe.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
         return recipe
 
-    def update(self, instance, validated_data):
-        """Обновление рецепта."""
-        instance.image = validated_data.get('image', instance.image)
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time', instance.cooking_time
+    def update_tags(self, instance, tags):
+        """Добавить новые и убрать лишние теги рецепта."""
+        current = set(instance.tags.values_list('id', flat=True))
+        wanted = set(tags)
+        if current - wanted:
+            instance.tags.remove(*(current - wanted))
+        if wanted - current:
+            instance.tags.add(*(wanted - current))
+
+    def update_ingredients(self, instance, ingredients):
+        """Применить к составу рецепта только изменившиеся строки."""
+        current = {
+            row.ingredient_id: row
+            for row in instance.amount_ingredient.all()
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in current.items()
+        }
+        wanted = {item['id'].id: item['amount'] for item in ingredients}
+        removed = [
+            row.id for ingredient_id, row in current.items()
+            if ingredient_id not in wanted
+        ]
+        changed = []
+        for ingredient_id, amount in wanted.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientAmount.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [item for item in ingredients if item['id'].id not in current],
+            instance,
         )
-        instance.tags.clear()
-        tags_data = self.initial_data.get('tags')
-        validateds_tags = self.validate_tags(tags_data)
-        instance.tags.set(validateds_tags)
-        instance.amount_ingredient.all().delete()
-        self.create_ingredients(validated_data.get('ingredients'), instance)
+        if old_amounts != wanted:
+            shopping_totals.change_recipe(instance, old_amounts, wanted)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """Обновление рецепта по разнице с текущим состоянием."""
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            shopping_totals.lock_recipe(instance)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if tags is not None:
+            self.update_tags(instance, tags)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        invalidate_recipes([instance])
         instance.save()
         return instance
 
@@ -238,59 +527,27 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 class RecipMiniSerializer(serializers.ModelSerializer):
     """Усечённый рецепт."""
 
+    image_variants = ImageVariantsField('image')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class FollowSerializer(serializers.ModelSerializer):
-    """Подписки."""
+class FollowSerializer(CustomUserSerializer):
+    """Подписки.
 
-    id = serializers.ReadOnlyField(source='following.id')
-    email = serializers.ReadOnlyField(source='following.email')
-    username = serializers.ReadOnlyField(source='following.username')
-    first_name = serializers.ReadOnlyField(source='following.first_name')
-    last_name = serializers.ReadOnlyField(source='following.last_name')
-    recipes = serializers.SerializerMethodField()
-    recipe_count = serializers.SerializerMethodField()
-    is_subscribed = serializers.SerializerMethodField()
+    Ожидает автора с аннотацией ``is_subscribed`` и рецептами,
+    предзагруженными в ``recent_recipes``.
+    """
 
-    class Meta:
-        model = Follow
+    recipes = RecipMiniSerializer(
+        many=True, read_only=True, source='recent_recipes'
+    )
+
+    class Meta(CustomUserSerializer.Meta):
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'recipes', 'recipe_count',
+            'is_subscribed', 'recipes', 'recipes_count', 'avatar',
+            'avatar_variants',
         )
-
-    def validate(self, data):
-        """Валдиация сериализатора."""
-        user = self.context['request'].user
-        following_id = self.context.get('following')
-        following = get_object_or_404(MyUser, pk=following_id)
-        if user == following:
-            raise serializers.ValidationError("Нельзя подписаться на себя")
-        if user.followers.filter(pk=following.pk).exists():
-            raise serializers.ValidationError("Вы уже подписаны")
-        return data
-
-    def create(self, validated_data):
-        user = self.context['request'].user
-        following_id = self.initial_data.get('following')
-        following = get_object_or_404(MyUser, id=following_id)
-        return Follow.objects.create(user=user, following=following)
-
-    def get_is_subscribed(self, obj):
-        """Проверка подписки."""
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return obj.following.followers.filter(user=user).exists()
-
-    def get_recipes(self, obj):
-        """Список рецептов подписанного пользователя."""
-        queryset = obj.following.recipes.all()
-        return RecipMiniSerializer(queryset, many=True).data
-
-    def get_recipe_count(self, obj):
-        """Количество рецептов."""
-        return obj.following.recipes.count()
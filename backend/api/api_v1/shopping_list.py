@@ -0,0 +1,324 @@
+"""Потоковая выгрузка списка покупок в txt, csv и pdf.
+
+Каждый формат — генератор байтовых фрагментов, который читает
+агрегированные строки по одной и не держит файл целиком в памяти.
+PDF собирается постранично: каждая страница — текст шрифтом
+``SHOPPING_LIST_FONT``, который отдаётся сразу. Подмножество шрифта с
+использованными символами и таблица xref дописываются в конце.
+"""
+import csv
+import io
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from fontTools import subset
+from fontTools.ttLib import TTFont, TTLibError
+
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_FONT_NUMBER = 3
+CYRILLIC_SAMPLE = 'АаЯяЁё'
+
+
+def format_line(row):
+    """Строка списка покупок."""
+    return (
+        f"{row['ingredient__name']} — {row['amount']} "
+        f"{row['ingredient__measurement_unit']}"
+    )
+
+
+def txt_chunks(rows):
+    """Список покупок в виде текста."""
+    for row in rows:
+        yield (format_line(row) + '\n').encode()
+
+
+class Echo:
+    """Буфер, который сразу возвращает записанное значение."""
+
+    def write(self, value):
+        """Вернуть записанную строку."""
+        return value
+
+
+def csv_chunks(rows):
+    """Список покупок в формате csv."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit')).encode()
+    for row in rows:
+        yield writer.writerow((
+            row['ingredient__name'],
+            row['amount'],
+            row['ingredient__measurement_unit'],
+        )).encode()
+
+
+class PdfFont:
+    """Метрики TrueType-шрифта и его подмножество для встраивания."""
+
+    def __init__(self, path):
+        try:
+            with open(path, 'rb') as file:
+                self.data = file.read()
+            font = TTFont(io.BytesIO(self.data))
+        except (OSError, TTLibError) as error:
+            raise ImproperlyConfigured(
+                f'SHOPPING_LIST_FONT: не удалось загрузить {path}: {error}'
+            ) from error
+        cmap = font.getBestCmap() or {}
+        if any(ord(char) not in cmap for char in CYRILLIC_SAMPLE):
+            raise ImproperlyConfigured(
+                f'SHOPPING_LIST_FONT: в {path} нет кириллицы.'
+            )
+        scale = 1000 / font['head'].unitsPerEm
+        self.glyphs = {
+            code: font.getGlyphID(name) for code, name in cmap.items()
+        }
+        self.widths = {
+            font.getGlyphID(name): round(font['hmtx'][name][0] * scale)
+            for name in set(cmap.values())
+        }
+        head = font['head']
+        self.bbox = [
+            round(value * scale)
+            for value in (head.xMin, head.yMin, head.xMax, head.yMax)
+        ]
+        self.ascent = round(font['hhea'].ascent * scale)
+        self.descent = round(font['hhea'].descent * scale)
+        self.name = font['name'].getDebugName(6) or 'Font'
+
+    def encode(self, text, used):
+        """Номера глифов строки в шестнадцатеричном виде."""
+        codes = []
+        for char in text:
+            glyph = self.glyphs.get(ord(char), 0)
+            used.setdefault(glyph, char)
+            codes.append(f'{glyph:04X}')
+        return ''.join(codes)
+
+    def subset(self, used):
+        """Файл шрифта только с использованными глифами.
+
+        Номера глифов сохраняются, поэтому уже отданные страницы
+        остаются верными.
+        """
+        options = subset.Options()
+        options.retain_gids = True
+        options.notdef_outline = True
+        options.drop_tables += ['FFTM']
+        font = TTFont(io.BytesIO(self.data))
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=[ord(char) for char in used.values()])
+        subsetter.subset(font)
+        buffer = io.BytesIO()
+        font.save(buffer)
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=1)
+def load_font(path):
+    """Шрифт списка покупок; без кириллицы — ошибка конфигурации."""
+    return PdfFont(path)
+
+
+class PdfStream:
+    """Инкрементальная запись PDF с текстовыми страницами.
+
+    Объекты 1 (каталог), 2 (дерево страниц) и 3 (шрифт) пишутся
+    последними, когда известны страницы и использованные глифы.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.used = {}
+        self.position = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_number = PDF_FONT_NUMBER + 1
+
+    def emit(self, data):
+        """Учесть длину фрагмента и вернуть его."""
+        self.position += len(data)
+        return data
+
+    def allocate(self):
+        """Номер следующего объекта."""
+        self.next_number += 1
+        return self.next_number - 1
+
+    def write_object(self, number, body, stream=None):
+        """Записать объект PDF."""
+        self.offsets[number] = self.position
+        data = f'{number} 0 obj\n'.encode() + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return self.emit(data + b'\nendobj\n')
+
+    def write_stream(self, number, stream, extra=''):
+        """Записать сжатый поток."""
+        stream = zlib.compress(stream)
+        return self.write_object(
+            number,
+            (
+                f'<< /Length {len(stream)} /Filter /FlateDecode{extra} >>'
+            ).encode(),
+            stream,
+        )
+
+    def header(self):
+        """Заголовок файла."""
+        return self.emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, lines):
+        """Объекты одной страницы: содержимое и страница."""
+        content_number, page_number = self.allocate(), self.allocate()
+        self.pages.append(page_number)
+        width, height = PDF_PAGE_SIZE
+        content = [
+            f'BT /F1 {PDF_FONT_SIZE} Tf {PDF_LINE_HEIGHT} TL '
+            f'{PDF_MARGIN} {height - PDF_MARGIN - PDF_FONT_SIZE} Td'
+        ]
+        content.extend(
+            f'<{self.font.encode(line, self.used)}> Tj T*' for line in lines
+        )
+        content.append('ET')
+        yield self.write_stream(
+            content_number, '\n'.join(content).encode()
+        )
+        yield self.write_object(
+            page_number,
+            (
+                f'<< /Type /Page /Parent 2 0 R '
+                f'/MediaBox [0 0 {width} {height}] '
+                f'/Resources << /Font << /F1 {PDF_FONT_NUMBER} 0 R >> >> '
+                f'/Contents {content_number} 0 R >>'
+            ).encode(),
+        )
+
+    def to_unicode(self):
+        """CMap для копирования и поиска текста."""
+        lines = [
+            '/CIDInit /ProcSet findresource begin',
+            '12 dict begin begincmap',
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            '/Supplement 0 >> def',
+            '/CMapName /Adobe-Identity-UCS def /CMapType 2 def',
+            '1 begincodespacerange <0000> <FFFF> endcodespacerange',
+        ]
+        used = sorted(self.used.items())
+        for start in range(0, len(used), 100):
+            block = used[start:start + 100]
+            lines.append(f'{len(block)} beginbfchar')
+            lines.extend(
+                f'<{glyph:04X}> <{char.encode("utf-16-be").hex().upper()}>'
+                for glyph, char in block
+            )
+            lines.append('endbfchar')
+        lines.append('endcmap CMapName currentdict /CMap defineresource pop')
+        lines.append('end end')
+        return '\n'.join(lines).encode()
+
+    def font_objects(self):
+        """Шрифт Type0 с подмножеством TrueType и таблицей ToUnicode."""
+        font = self.font
+        name = f'AAAAAA+{font.name}'
+        cid_font, descriptor, file_number, unicode_number = (
+            self.allocate() for _ in range(4)
+        )
+        widths = ' '.join(
+            f'{glyph} [{font.widths.get(glyph, 0)}]'
+            for glyph in sorted(self.used)
+        )
+        font_file = font.subset(self.used)
+        yield self.write_object(
+            PDF_FONT_NUMBER,
+            (
+                f'<< /Type /Font /Subtype /Type0 /BaseFont /{name} '
+                f'/Encoding /Identity-H /DescendantFonts [{cid_font} 0 R] '
+                f'/ToUnicode {unicode_number} 0 R >>'
+            ).encode(),
+        )
+        yield self.write_object(
+            cid_font,
+            (
+                f'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{name} '
+                f'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+                f'/Supplement 0 >> /FontDescriptor {descriptor} 0 R '
+                f'/CIDToGIDMap /Identity /W [{widths}] >>'
+            ).encode(),
+        )
+        bbox = ' '.join(str(value) for value in font.bbox)
+        yield self.write_object(
+            descriptor,
+            (
+                f'<< /Type /FontDescriptor /FontName /{name} /Flags 32 '
+                f'/FontBBox [{bbox}] /ItalicAngle 0 '
+                f'/Ascent {font.ascent} /Descent {font.descent} '
+                f'/CapHeight {font.ascent} /StemV 80 '
+                f'/FontFile2 {file_number} 0 R >>'
+            ).encode(),
+        )
+        yield self.write_stream(
+            file_number, font_file, f' /Length1 {len(font_file)}'
+        )
+        yield self.write_stream(unicode_number, self.to_unicode())
+
+    def trailer(self):
+        """Шрифт, дерево страниц, каталог, таблица xref и трейлер."""
+        yield from self.font_objects()
+        kids = ' '.join(f'{number} 0 R' for number in self.pages)
+        yield self.write_object(
+            2,
+            (
+                f'<< /Type /Pages /Kids [{kids}] '
+                f'/Count {len(self.pages)} >>'
+            ).encode(),
+        )
+        yield self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref_position = self.position
+        lines = [f'xref\n0 {self.next_number}\n', '0000000000 65535 f \n']
+        lines.extend(
+            f'{self.offsets[number]:010d} 00000 n \n'
+            for number in range(1, self.next_number)
+        )
+        lines.append(
+            f'trailer\n<< /Size {self.next_number} /Root 1 0 R >>\n'
+            f'startxref\n{xref_position}\n%%EOF\n'
+        )
+        yield self.emit(''.join(lines).encode())
+
+
+def pdf_pages(rows, pdf):
+    """Страницы PDF по мере чтения строк."""
+    per_page = (PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LINE_HEIGHT
+    yield pdf.header()
+    lines = []
+    for row in rows:
+        lines.append(format_line(row))
+        if len(lines) == per_page:
+            yield from pdf.page(lines)
+            lines = []
+    if lines or not pdf.pages:
+        yield from pdf.page(lines)
+    yield from pdf.trailer()
+
+
+def pdf_chunks(rows):
+    """Список покупок в формате pdf.
+
+    Шрифт загружается сразу, чтобы ошибка конфигурации случилась до
+    начала ответа, а не посреди потока.
+    """
+    return pdf_pages(rows, PdfStream(load_font(settings.SHOPPING_LIST_FONT)))
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', txt_chunks),
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+    'pdf': ('application/pdf', pdf_chunks),
+}
@@ -0,0 +1,176 @@
+"""Ограничение частоты запросов скользящим окном в общем хранилище.
+
+Для каждого клиента хранятся только два счётчика: текущего и прошлого
+окна. Оценка числа запросов за последние ``duration`` секунд —
+счётчик текущего окна плюс доля прошлого, пропорциональная перекрытию.
+Хранилище общее для всех воркеров: кэш Django, если он общий (по
+умолчанию в этом случае), иначе файл SQLite на хосте.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import (AnonRateThrottle, ScopedRateThrottle,
+                                       SimpleRateThrottle, UserRateThrottle)
+
+
+def sliding_window(previous, current, limit, duration, now):
+    """Решение по счётчикам окон: (разрешить, секунд до повтора)."""
+    elapsed = (now % duration) / duration
+    if previous * (1 - elapsed) + current < limit:
+        return True, None
+    if current >= limit or not previous:
+        return False, duration * (1 - elapsed)
+    passes = 1 - (limit - current) / previous
+    return False, max(passes - elapsed, 0) * duration
+
+
+class SqliteWindowStore:
+    """Счётчики окон в файле SQLite, общем для воркеров хоста.
+
+    Строка окна нужна до конца следующего окна. Просроченные строки всех
+    ключей удаляются на каждом ``prune_every``-м запросе процесса, иначе
+    таблица росла бы на каждого когда-либо приходившего клиента.
+    """
+
+    prune_every = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.hits = itertools.count(1)
+
+    def connection(self):
+        """Соединение текущего потока и процесса."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS throttle_windows ('
+                'key TEXT, window INTEGER, count INTEGER, expires REAL, '
+                'PRIMARY KEY (key, window)) WITHOUT ROWID'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS throttle_windows_expires '
+                'ON throttle_windows (expires)'
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def hit(self, key, limit, duration):
+        """Учесть запрос, если он укладывается в лимит."""
+        now = time.time()
+        window = int(now // duration)
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            counts = dict(connection.execute(
+                'SELECT window, count FROM throttle_windows '
+                'WHERE key = ? AND window IN (?, ?)',
+                (key, window - 1, window),
+            ).fetchall())
+            allowed, wait = sliding_window(
+                counts.get(window - 1, 0), counts.get(window, 0),
+                limit, duration, now,
+            )
+            if allowed:
+                connection.execute(
+                    'INSERT INTO throttle_windows '
+                    '(key, window, count, expires) '
+                    'VALUES (?, ?, 1, ?) ON CONFLICT (key, window) '
+                    'DO UPDATE SET count = count + 1',
+                    (key, window, (window + 2) * duration),
+                )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if next(self.hits) % self.prune_every == 0:
+            self.prune(now)
+        return allowed, wait
+
+    def prune(self, now):
+        """Удалить окна всех ключей, которые больше не участвуют в оценке."""
+        self.connection().execute(
+            'DELETE FROM throttle_windows WHERE expires < ?', (now,)
+        )
+
+
+class CacheWindowStore:
+    """Счётчики окон в кэше Django с атомарным ``incr``."""
+
+    def hit(self, key, limit, duration):
+        """Учесть запрос, если он укладывается в лимит."""
+        now = time.time()
+        window = int(now // duration)
+        previous_key = f'throttle:{key}:{window - 1}'
+        current_key = f'throttle:{key}:{window}'
+        counts = cache.get_many((previous_key, current_key))
+        allowed, wait = sliding_window(
+            counts.get(previous_key, 0), counts.get(current_key, 0),
+            limit, duration, now,
+        )
+        if allowed:
+            cache.add(current_key, 0, duration * 2)
+            try:
+                cache.incr(current_key)
+            except ValueError:
+                cache.set(current_key, 1, duration * 2)
+        return allowed, wait
+
+
+store = None
+
+
+def get_store():
+    """Хранилище счётчиков из настроек."""
+    global store
+    if store is None:
+        if settings.THROTTLE_STORE == 'cache':
+            store = CacheWindowStore()
+        else:
+            store = SqliteWindowStore(settings.THROTTLE_SQLITE_PATH)
+    return store
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """``SimpleRateThrottle`` со скользящим окном вместо списка времён."""
+
+    def allow_request(self, request, view):
+        """Проверить лимит одним обращением к хранилищу."""
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self.wait_seconds = get_store().hit(
+            self.key, self.num_requests, self.duration
+        )
+        return allowed
+
+    def wait(self):
+        """Сколько секунд ждать до следующего разрешённого запроса."""
+        return self.wait_seconds
+
+
+class UserSlidingRateThrottle(UserRateThrottle, SlidingWindowRateThrottle):
+    """Лимит для пользователя."""
+
+
+class AnonSlidingRateThrottle(AnonRateThrottle, SlidingWindowRateThrottle):
+    """Лимит для анонимного клиента."""
+
+
+class ScopedSlidingRateThrottle(
+    ScopedRateThrottle, SlidingWindowRateThrottle
+):
+    """Отдельный лимит для действий с ``throttle_scope``."""
@@ -0,0 +1,163 @@
+"""Загрузка изображений без копий всего файла в памяти.
+
+Файлы из multipart-запросов пишутся во временный файл по мере чтения,
+размер и формат проверяются на лету. Base64 из JSON по-прежнему
+принимается, но декодируется кусками сразу во временный файл.
+"""
+import base64
+import binascii
+import os
+import re
+import tempfile
+import uuid
+import weakref
+from contextlib import suppress
+
+import filetype
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import ImageField
+
+BASE64_CHUNK_SIZE = 64 * 1024
+SIGNATURE_SIZE = 261
+WHITESPACE = re.compile(r'\s')
+
+
+def guess_image_extension(head):
+    """Расширение изображения по первым байтам или None."""
+    extension = filetype.guess_extension(head)
+    if extension in Base64ImageField.ALLOWED_TYPES:
+        return extension
+    return None
+
+
+def remove_file(path):
+    """Удалить файл, если его ещё не перенесло хранилище."""
+    with suppress(FileNotFoundError):
+        os.remove(path)
+
+
+class DecodedUploadedFile(UploadedFile):
+    """Временный файл с раскодированным base64.
+
+    Хранилище переносит его на место без копирования, а неиспользованный
+    файл удаляется вместе с объектом.
+    """
+
+    def __init__(self, content_type):
+        file = tempfile.NamedTemporaryFile(
+            suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False
+        )
+        super().__init__(file, 'upload', content_type, 0, None)
+        weakref.finalize(self, remove_file, file.name)
+
+    def temporary_file_path(self):
+        """Путь к временному файлу."""
+        return self.file.name
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Запись загружаемого файла на диск с проверками по мере чтения.
+
+    Отклонённый файл пропускается, а причина сохраняется в
+    ``request.rejected_uploads`` для сообщения об ошибке в сериализаторе.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        """Начать новый файл."""
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        """Проверить очередной кусок и записать его во временный файл."""
+        if not self.received and guess_image_extension(
+            raw_data[:SIGNATURE_SIZE]
+        ) is None:
+            self.reject('invalid_type')
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.reject('too_large')
+        return super().receive_data_chunk(raw_data, start)
+
+    def reject(self, code):
+        """Отбросить файл и запомнить причину."""
+        self.file.close()
+        if not hasattr(self.request, 'rejected_uploads'):
+            self.request.rejected_uploads = {}
+        self.request.rejected_uploads[self.field_name] = code
+        raise SkipFile()
+
+
+class StreamingImageField(Base64ImageField):
+    """Изображение из multipart-файла или base64-строки."""
+
+    default_error_messages = {
+        'too_large': 'Размер изображения больше {max_size} байт.',
+        'invalid_type': Base64ImageField.INVALID_TYPE_MESSAGE,
+        'invalid_file': Base64ImageField.INVALID_FILE_MESSAGE,
+    }
+
+    def fail(self, key, **kwargs):
+        """Ошибка с подставленным лимитом размера."""
+        kwargs.setdefault('max_size', settings.IMAGE_UPLOAD_MAX_SIZE)
+        super().fail(key, **kwargs)
+
+    def validate_empty_values(self, data):
+        """Сообщить о файле, отклонённом при чтении запроса."""
+        request = self.context.get('request')
+        code = getattr(request, 'rejected_uploads', {}).get(self.field_name)
+        if code:
+            self.fail(code)
+        return super().validate_empty_values(data)
+
+    def to_internal_value(self, data):
+        """Проверить файл или раскодировать base64 во временный файл."""
+        if data in self.EMPTY_VALUES:
+            return None
+        if isinstance(data, UploadedFile):
+            return self.validate_file(data)
+        if isinstance(data, str):
+            return self.validate_file(self.decode(data))
+        return super().to_internal_value(data)
+
+    def validate_file(self, file):
+        """Проверить размер и формат и передать файл ImageField."""
+        if file.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large')
+        file.seek(0)
+        extension = guess_image_extension(file.read(SIGNATURE_SIZE))
+        if extension is None:
+            self.fail('invalid_type')
+        file.seek(0)
+        file.name = f'{uuid.uuid4()}.{extension}'
+        return ImageField.to_internal_value(self, file)
+
+    def decode(self, data):
+        """Раскодировать base64 кусками во временный файл."""
+        header, _, payload = data.rpartition(';base64,')
+        if WHITESPACE.search(payload):
+            payload = ''.join(payload.split())
+        if len(payload) // 4 * 3 > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large')
+        file = DecodedUploadedFile(header.replace('data:', '') or None)
+        try:
+            for start in range(0, len(payload), BASE64_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    payload[start:start + BASE64_CHUNK_SIZE], validate=True
+                )
+                if not start and guess_image_extension(
+                    chunk[:SIGNATURE_SIZE]
+                ) is None:
+                    self.fail('invalid_type')
+                file.write(chunk)
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_file')
+        except Exception:
+            file.close()
+            raise
+        file.size = file.tell()
+        return file
@@ -1,27 +1,39 @@
 from http import HTTPStatus
 
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window)
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (Ingredient, IngredientAmount, Recipe, ShoppingCart,
-                            Tags)
+from recipes import shopping_totals
+from recipes.models import (ContentVersion, Favorite, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, Tags)
 from rest_framework import filters, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from users.models import Follow, MyUser
 
+from .autocomplete import search_ingredients
+from .cache import invalidate_recipes
+from .constants import (AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT,
+                        SHOPPING_LIST_CHUNK_SIZE)
 from .filter import RecipeFilter
-from .pagination import CustomPagination
+from .mixins import ConditionalGetMixin, QueryBudgetMixin
+from .negotiation import ShoppingListNegotiation
+from .pagination import CustomPagination, RecipePagination
 from .permissions import OwnerPermission
 from .serializers import (CustomUserSerializer, FollowSerializer,
                           IngtedienSerializer, RecipeReadSerializer,
                           RecipeWriteSerializer, RecipMiniSerializer,
-                          SetPasswordSerializer, TagSerializer, UserAvatarAdd,
-                          UserCreateSerializer)
+                          SetPasswordSerializer, ShoppingListItemSerializer,
+                          TagSerializer, UserAvatarAdd, UserCreateSerializer,
+                          UserProfileSerializer)
+from .shopping_list import FORMATS as SHOPPING_LIST_FORMATS
 
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
@@ -43,17 +55,32 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        """Список ингредиентов, автодополнение по параметру name."""
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            limit = AUTOCOMPLETE_LIMIT
+        limit = min(max(limit, 1), AUTOCOMPLETE_MAX_LIMIT)
+        return Response(search_ingredients(name, limit))
+
 
 class UserViewSet(viewsets.ModelViewSet):
     """Пользователь."""
 
     queryset = MyUser.objects.all()
     pagination_class = CustomPagination
+    throttle_scope = None
 
     def get_serializer_class(self):
         """Выбор сериализатора."""
         if self.action == 'create':
             return UserCreateSerializer
+        if self.action in ('retrieve', 'me'):
+            return UserProfileSerializer
         return CustomUserSerializer
 
     @action(
@@ -91,6 +118,7 @@ class UserViewSet(viewsets.ModelViewSet):
         methods=['put', 'delete'],
         url_path='me/avatar',
         permission_classes=[OwnerPermission],
+        throttle_scope='uploads',
     )
     def avatar(self, request):
         """Аватар пользователя."""
@@ -102,15 +130,49 @@ class UserViewSet(viewsets.ModelViewSet):
                 {'avatar': None},
                 status=HTTPStatus.NO_CONTENT
             )
-        if 'avatar' not in request.data:
+        if 'avatar' not in request.data and not getattr(
+            request, 'rejected_uploads', None
+        ):
             return Response(status=HTTPStatus.BAD_REQUEST)
         serializer = UserAvatarAdd(
-            instance=user, data=request.data, partial=True
+            instance=user, data=request.data, partial=True,
+            context={'request': request}
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response({'avatar': user.avatar.url}, status=HTTPStatus.OK)
 
+    def get_recipes_limit(self):
+        """Ограничение числа рецептов автора из параметра recipes_limit."""
+        try:
+            limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(limit, 0)
+
+    def annotate_subscriptions(self, authors):
+        """Авторы с числом рецептов и последними рецептами.
+
+        Последние рецепты выбираются одним запросом с оконной функцией,
+        количество рецептов берётся из счётчика автора.
+        """
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id', 'pub_date'
+        )
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            recipes = recipes.annotate(position=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )).filter(position__lte=limit)
+        return authors.annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recent_recipes')
+        )
+
     @action(
         detail=False,
         methods=['get'],
@@ -118,7 +180,10 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscriptions(self, request):
         """Подписки."""
-        authors = Follow.objects.filter(user=request.user)
+        authors = self.annotate_subscriptions(
+            MyUser.objects.filter(followers__user=request.user)
+            .order_by('followers__id')
+        )
         result_page = self.paginate_queryset(authors)
         serializer = FollowSerializer(
             result_page, many=True, context={'request': request}
@@ -135,15 +200,36 @@ class UserViewSet(viewsets.ModelViewSet):
         author = get_object_or_404(MyUser, id=pk)
         user = request.user
         if request.method == 'POST':
-            follow = Follow.objects.create(user=user, following=author)
+            if user == author:
+                return Response(
+                    {'errors': 'Нельзя подписаться на себя'},
+                    status=HTTPStatus.BAD_REQUEST
+                )
+            if user.follows.filter(following=author).exists():
+                return Response(
+                    {'errors': 'Вы уже подписаны'},
+                    status=HTTPStatus.BAD_REQUEST
+                )
+            with transaction.atomic():
+                Follow.objects.create(user=user, following=author)
+                MyUser.objects.filter(pk=author.pk).update(
+                    followers_count=F('followers_count') + 1
+                )
             serializer = FollowSerializer(
-                follow, context={'request': request}
+                self.annotate_subscriptions(
+                    MyUser.objects.filter(pk=author.pk)
+                ).get(),
+                context={'request': request}
             )
             return Response(serializer.data, status=HTTPStatus.CREATED)
         if request.method == 'DELETE':
             follow = Follow.objects.filter(user=user, following=author)
             if follow.exists():
-                follow.delete()
+                with transaction.atomic():
+                    follow.delete()
+                    MyUser.objects.filter(pk=author.pk).update(
+                        followers_count=F('followers_count') - 1
+                    )
                 return Response(status=HTTPStatus.NO_CONTENT)
             return Response(
                 {'errors': 'Подписки нет'},
@@ -151,14 +237,70 @@ class UserViewSet(viewsets.ModelViewSet):
             )
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    QueryBudgetMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """ViewSet для рецептов."""
 
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    pagination_class = PageNumberPagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    query_budget = {'list': 9, 'retrieve': 6}
+    throttle_scope = None
+
+    def get_queryset(self):
+        """Рецепты с отметками текущего пользователя."""
+        user = self.request.user
+        if user.is_anonymous:
+            return Recipe.objects.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                author_is_subscribed=Value(
+                    False, output_field=BooleanField()
+                ),
+            )
+        return Recipe.objects.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            author_is_subscribed=Exists(
+                Follow.objects.filter(
+                    user=user, following=OuterRef('author')
+                )
+            ),
+        )
+
+    def get_etag_state(self):
+        """Версия рецептов и состояние текущего пользователя."""
+        if self.action == 'retrieve':
+            try:
+                return self.get_queryset().filter(
+                    pk=self.kwargs[self.lookup_field]
+                ).values_list(
+                    'updated_at', 'is_favorited', 'is_in_shopping_cart',
+                    'author_is_subscribed', 'favorites_count',
+                ).first()
+            except (TypeError, ValueError):
+                return None
+        keys = [ContentVersion.RECIPES]
+        if self.request.user.is_authenticated:
+            keys.append(ContentVersion.user_key(self.request.user.pk))
+        return ContentVersion.objects.read(*keys)
+
+    def get_last_modified(self, state):
+        """Время изменения рецепта для анонимных запросов.
+
+        У авторизованных пользователей ответ зависит от избранного и
+        подписок, у списка — от удалений, поэтому там только ETag.
+        """
+        if self.action == 'retrieve' and self.request.user.is_anonymous:
+            return state[0]
+        return None
 
     def get_serializer_class(self):
         """Выбор сериализатора."""
@@ -174,7 +316,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Удаление рецепта."""
         recipe = self.get_object()
         if recipe.author == request.user:
-            recipe.delete()
+            invalidate_recipes([recipe])
+            with transaction.atomic():
+                recipe.delete()
+                MyUser.objects.filter(pk=recipe.author_id).update(
+                    recipes_count=F('recipes_count') - 1
+                )
             return Response(status=HTTPStatus.NO_CONTENT)
         return Response(status=HTTPStatus.FORBIDDEN)
 
@@ -218,7 +365,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     {'errors': 'Рецепт уже в избранном'},
                     status=HTTPStatus.BAD_REQUEST,
                 )
-            user.favorites.create(recipe=recipe)
+            with transaction.atomic():
+                user.favorites.create(recipe=recipe)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    favorites_count=F('favorites_count') + 1,
+                    updated_at=timezone.now(),
+                )
             serializer = RecipMiniSerializer(
                 recipe, context={'request': request}
             )
@@ -230,7 +382,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     {'errors': 'Рецепта нет в избранном'},
                     status=HTTPStatus.BAD_REQUEST,
                 )
-            favorite.delete()
+            with transaction.atomic():
+                favorite.delete()
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    favorites_count=F('favorites_count') - 1,
+                    updated_at=timezone.now(),
+                )
             return Response(status=HTTPStatus.NO_CONTENT)
 
     @action(
@@ -244,41 +401,75 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipe = get_object_or_404(Recipe, pk=pk)
         user = request.user
         if request.method == 'POST':
-            if user.cart.filter(recipe=recipe).exists():
-                return Response(
-                    {'errors': 'Рецепт уже в списке покупок'},
-                    status=HTTPStatus.BAD_REQUEST,
-                )
-            ShoppingCart.objects.create(user=user, recipe=recipe)
+            with transaction.atomic():
+                if not shopping_totals.lock_recipe(recipe):
+                    return Response(status=HTTPStatus.NOT_FOUND)
+                if user.cart.filter(recipe=recipe).exists():
+                    return Response(
+                        {'errors': 'Рецепт уже в списке покупок'},
+                        status=HTTPStatus.BAD_REQUEST,
+                    )
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+                shopping_totals.add_recipe(user, recipe)
             serializer = RecipMiniSerializer(
                 recipe, context={'request': request}
             )
             return Response(serializer.data, status=HTTPStatus.CREATED)
         if request.method == 'DELETE':
-            cart = user.cart.filter(recipe=recipe).first()
-            if cart:
-                cart.delete()
+            with transaction.atomic():
+                shopping_totals.lock_recipe(recipe)
+                deleted, _ = user.cart.filter(recipe=recipe).delete()
+                if deleted:
+                    shopping_totals.remove_recipe(user, recipe)
+            if deleted:
                 return Response(status=HTTPStatus.NO_CONTENT)
             return Response(status=HTTPStatus.BAD_REQUEST)
 
-    @action(detail=False, methods=['get'], url_path='download_shopping_cart')
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='shopping_list',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_list(self, request):
+        """Итоги списка покупок."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        serializer = ShoppingListItemSerializer(items, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='download_shopping_cart',
+        permission_classes=[IsAuthenticated],
+        content_negotiation_class=ShoppingListNegotiation,
+        throttle_scope='shopping_list',
+    )
     def download_shopping_cart(self, request):
-        """Скачать список покупок."""
-        recipe_ids = request.user.cart.values_list('recipe__id', flat=True)
+        """Скачать список покупок в формате txt, csv или pdf."""
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'errors': 'Формат должен быть одним из: '
+                           + ', '.join(SHOPPING_LIST_FORMATS)},
+                status=HTTPStatus.BAD_REQUEST,
+            )
+        content_type, chunks = SHOPPING_LIST_FORMATS[file_format]
         ingredients = (
-            IngredientAmount.objects.filter(recipe__id__in=recipe_ids)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount=Sum('amount'))
+            ShoppingListItem.objects.filter(user=request.user)
+            .values(
+                'ingredient__name', 'ingredient__measurement_unit',
+                amount=F('total_amount'),
+            )
             .order_by('ingredient__name')
+            .iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+        )
+        response = StreamingHttpResponse(
+            chunks(ingredients), content_type=content_type
         )
-        content = ''
-        for ing in ingredients:
-            content += (
-                f"{ing['ingredient__name']} — {ing['amount']} "
-                f"{ing['ingredient__measurement_unit']}\n"
-            )
-        response = HttpResponse(content, content_type='text/plain')
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.txt"'
+            f'attachment; filename="shopping_cart.{file_format}"'
         )
         return response
@@ -0,0 +1,65 @@
+"""Статистика подключений к базе данных в текущем процессе.
+
+Соединения живут ``CONN_MAX_AGE`` секунд и переиспользуются между
+запросами, поэтому главное, что стоит наблюдать, — сколько соединений
+открыто и сколько времени запросы ждут установки новых.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    """Счётчики подключений по алиасам баз."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Начать с нуля, например в новом воркере после fork."""
+        self.lock = threading.Lock()
+        self.aliases = defaultdict(lambda: {
+            'open': 0,
+            'opened_total': 0,
+            'closed_total': 0,
+            'connect_seconds_total': 0.0,
+            'connect_seconds_max': 0.0,
+        })
+
+    def connected(self, alias, seconds):
+        """Учесть новое соединение и время его установки."""
+        with self.lock:
+            stats = self.aliases[alias]
+            stats['open'] += 1
+            stats['opened_total'] += 1
+            stats['connect_seconds_total'] += seconds
+            stats['connect_seconds_max'] = max(
+                stats['connect_seconds_max'], seconds
+            )
+        if seconds > settings.DB_SLOW_CONNECT_SECONDS:
+            logger.warning(
+                'Подключение к базе %s заняло %.3f с', alias, seconds
+            )
+
+    def closed(self, alias):
+        """Учесть закрытое соединение."""
+        with self.lock:
+            stats = self.aliases[alias]
+            stats['open'] = max(stats['open'] - 1, 0)
+            stats['closed_total'] += 1
+
+    def snapshot(self):
+        """Копия счётчиков вида {алиас: {счётчик: значение}}."""
+        with self.lock:
+            return {
+                alias: dict(stats) for alias, stats in self.aliases.items()
+            }
+
+
+connection_stats = ConnectionStats()
+os.register_at_fork(after_in_child=connection_stats.reset)
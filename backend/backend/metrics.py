@@ -0,0 +1,520 @@
+"""Метрики в формате Prometheus, общие для воркеров gunicorn.
+
+Каждый процесс копит счётчики в памяти, а фоновый поток раз в
+``METRICS_FLUSH_SECONDS`` записывает их текущие значения в файл SQLite
+на хосте, даже если воркер простаивает. ``/metrics`` складывает значения
+всех процессов, поэтому ответ не зависит от того, какой воркер его
+отдал. Счётчики
+завершившихся процессов переносятся в общую строку и не пропадают, а
+их текущие соединения с базой больше не учитываются.
+"""
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+
+from .db_stats import connection_stats
+from .profiling import view_name
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf')
+)
+HTTP_METHODS = frozenset(
+    ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Запросы по действию вьюсета, методу и статусу.'
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса по действию вьюсета.'
+    ),
+    'foodgram_db_queries_total': ('counter', 'SQL-запросы по базам.'),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов.'
+    ),
+    'foodgram_db_connections_open': (
+        'gauge', 'Открытые соединения с базой.'
+    ),
+    'foodgram_db_connections_opened_total': (
+        'counter', 'Установленные соединения с базой.'
+    ),
+    'foodgram_db_connections_closed_total': (
+        'counter', 'Закрытые соединения с базой.'
+    ),
+    'foodgram_db_connect_duration_seconds_total': (
+        'counter', 'Суммарное время установки соединений.'
+    ),
+    'foodgram_db_connect_duration_seconds_max': (
+        'gauge', 'Самая долгая установка соединения.'
+    ),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшам: попадания (hit) и промахи (miss).'
+    ),
+    'foodgram_cache_hit_ratio': (
+        'gauge', 'Доля попаданий в кэш за всё время работы.'
+    ),
+}
+CONNECTION_COUNTERS = {
+    'opened_total': 'foodgram_db_connections_opened_total',
+    'closed_total': 'foodgram_db_connections_closed_total',
+    'connect_seconds_total': 'foodgram_db_connect_duration_seconds_total',
+}
+CONNECTION_GAUGES = {
+    'open': ('foodgram_db_connections_open', sum),
+    'connect_seconds_max': ('foodgram_db_connect_duration_seconds_max', max),
+}
+GAUGE_AGGREGATES = dict(CONNECTION_GAUGES.values())
+LE_LABEL = re.compile(r'le="([^"]+)"')
+
+
+def escape(value):
+    """Значение метки с экранированием по формату Prometheus."""
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def labels(**values):
+    """Метки в формате Prometheus: ``a="1",b="2"``."""
+    return ','.join(
+        f'{name}="{escape(value)}"' for name, value in sorted(values.items())
+    )
+
+
+def format_value(value):
+    """Число без лишней дробной части."""
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def process_alive(pid):
+    """Жив ли процесс на этом хосте."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """Значения процессов в файле SQLite, общем для воркеров хоста."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        """Соединение текущего потока и процесса."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS counters ('
+                'process TEXT, pid INTEGER, name TEXT, labels TEXT, '
+                'value REAL, PRIMARY KEY (process, name, labels)) '
+                'WITHOUT ROWID'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS gauges ('
+                'pid INTEGER, name TEXT, labels TEXT, value REAL, '
+                'PRIMARY KEY (pid, name, labels)) WITHOUT ROWID'
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def transaction(self, callback):
+        """Выполнить ``callback(connection)`` в транзакции с записью."""
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = callback(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return result
+
+    def save(self, process, pid, counters, gauges):
+        """Записать текущие значения процесса."""
+        def save(connection):
+            connection.executemany(
+                'INSERT INTO counters (process, pid, name, labels, value) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (process, name, labels) '
+                'DO UPDATE SET value = excluded.value',
+                [
+                    (process, pid, name, label, value)
+                    for (name, label), value in counters.items()
+                ],
+            )
+            connection.execute('DELETE FROM gauges WHERE pid = ?', (pid,))
+            connection.executemany(
+                'INSERT INTO gauges (pid, name, labels, value) '
+                'VALUES (?, ?, ?, ?)',
+                [
+                    (pid, name, label, value)
+                    for (name, label), value in gauges.items()
+                ],
+            )
+
+        self.transaction(save)
+
+    def load(self):
+        """Сумма счётчиков и показатели живых процессов."""
+        def load(connection):
+            for (pid,) in connection.execute(
+                'SELECT DISTINCT pid FROM counters WHERE pid != 0'
+            ).fetchall():
+                if not process_alive(pid):
+                    self.forget(connection, pid)
+            for (pid,) in connection.execute(
+                'SELECT DISTINCT pid FROM gauges'
+            ).fetchall():
+                if not process_alive(pid):
+                    self.forget(connection, pid)
+            counters = connection.execute(
+                'SELECT name, labels, SUM(value) FROM counters '
+                'GROUP BY name, labels'
+            ).fetchall()
+            gauges = connection.execute(
+                'SELECT name, labels, value FROM gauges'
+            ).fetchall()
+            return counters, gauges
+
+        return self.transaction(load)
+
+    def forget(self, connection, pid):
+        """Перенести счётчики завершившегося процесса в общую строку."""
+        connection.execute(
+            "INSERT INTO counters (process, pid, name, labels, value) "
+            "SELECT '', 0, name, labels, value FROM counters WHERE pid = ? "
+            "ON CONFLICT (process, name, labels) "
+            "DO UPDATE SET value = value + excluded.value",
+            (pid,),
+        )
+        connection.execute('DELETE FROM counters WHERE pid = ?', (pid,))
+        connection.execute('DELETE FROM gauges WHERE pid = ?', (pid,))
+
+
+class ProcessMetrics:
+    """Счётчики текущего процесса."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Начать с нуля, например в новом воркере после fork."""
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.process = uuid.uuid4().hex
+        self.flusher_pid = None
+
+    def inc(self, name, label, value=1):
+        """Увеличить счётчик."""
+        with self.lock:
+            self.counters[(name, label)] += value
+
+    def observe(self, name, label, value):
+        """Учесть значение в гистограмме."""
+        with self.lock:
+            for bound in DURATION_BUCKETS:
+                bucket = f'{label},le="{format_value(bound)}"'.lstrip(',')
+                self.counters[(f'{name}_bucket', bucket)] += value <= bound
+            self.counters[(f'{name}_sum', label)] += value
+            self.counters[(f'{name}_count', label)] += 1
+
+    def snapshot(self):
+        """Счётчики процесса вместе со статистикой соединений."""
+        with self.lock:
+            counters = dict(self.counters)
+        gauges = {}
+        for alias, stats in connection_stats.snapshot().items():
+            label = labels(alias=alias)
+            for key, name in CONNECTION_COUNTERS.items():
+                counters[(name, label)] = stats[key]
+            for key, (name, _) in CONNECTION_GAUGES.items():
+                gauges[(name, label)] = stats[key]
+        return counters, gauges
+
+    def flush(self):
+        """Записать значения процесса в общее хранилище."""
+        counters, gauges = self.snapshot()
+        try:
+            get_store().save(self.process, os.getpid(), counters, gauges)
+        except sqlite3.Error as error:
+            logger.warning('Не удалось сохранить метрики: %s', error)
+
+    def start_flusher(self):
+        """Запустить в процессе поток периодической записи.
+
+        Потоки не переживают fork, поэтому в каждом воркере поток
+        запускается заново при первом запросе.
+        """
+        if self.flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(
+            target=self.flush_periodically, name='metrics-flush', daemon=True
+        ).start()
+
+    def flush_periodically(self):
+        """Записывать значения раз в ``METRICS_FLUSH_SECONDS``."""
+        pid = os.getpid()
+        while self.flusher_pid == pid:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            self.flush()
+
+
+process_metrics = ProcessMetrics()
+os.register_at_fork(after_in_child=process_metrics.reset)
+
+store = None
+
+
+def get_store():
+    """Хранилище метрик из настроек."""
+    global store
+    if store is None:
+        store = MetricsStore(settings.METRICS_SQLITE_PATH)
+    return store
+
+
+def record_cache(cache, hits=0, misses=0):
+    """Учесть попадания и промахи кэша."""
+    if hits:
+        process_metrics.inc(
+            'foodgram_cache_requests_total',
+            labels(cache=cache, result='hit'), hits,
+        )
+    if misses:
+        process_metrics.inc(
+            'foodgram_cache_requests_total',
+            labels(cache=cache, result='miss'), misses,
+        )
+
+
+def count_query(execute, sql, params, many, context):
+    """Обёртка выполнения SQL для счётчиков по базам."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        label = labels(alias=context['connection'].alias)
+        process_metrics.inc('foodgram_db_queries_total', label)
+        process_metrics.inc(
+            'foodgram_db_query_duration_seconds_total', label,
+            time.perf_counter() - started,
+        )
+
+
+def install_query_counter(connection, **kwargs):
+    """Подключить счётчики SQL к соединению."""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+connection_created.connect(install_query_counter)
+
+
+def cache_ratios(counters):
+    """Доли попаданий по кэшам из суммарных счётчиков."""
+    results = defaultdict(dict)
+    for name, label, value in counters:
+        if name == 'foodgram_cache_requests_total':
+            cache = re.search(r'cache="([^"]*)"', label).group(1)
+            result = re.search(r'result="([^"]*)"', label).group(1)
+            results[cache][result] = value
+    return [
+        ('foodgram_cache_hit_ratio', labels(cache=cache),
+         counts.get('hit', 0) / sum(counts.values()))
+        for cache, counts in results.items()
+    ]
+
+
+def family(name):
+    """Имя метрики без суффиксов гистограммы."""
+    for suffix in ('_bucket', '_sum', '_count'):
+        base = name.removesuffix(suffix)
+        if base != name and METRICS.get(base, ('',))[0] == 'histogram':
+            return base
+    return name
+
+
+def sample_order(sample):
+    """Порядок строк: по метрике, меткам и границе корзины."""
+    name, label, _ = sample
+    le = LE_LABEL.search(label)
+    return (
+        family(name), name, LE_LABEL.sub('', label),
+        float(le.group(1)) if le else 0,
+    )
+
+
+def render(counters, gauges):
+    """Текст в формате Prometheus."""
+    aggregated = defaultdict(list)
+    for name, label, value in gauges:
+        aggregated[(name, label)].append(value)
+    samples = list(counters) + [
+        (name, label, GAUGE_AGGREGATES.get(name, sum)(values))
+        for (name, label), values in aggregated.items()
+    ] + cache_ratios(counters)
+    lines = []
+    current = None
+    for name, label, value in sorted(samples, key=sample_order):
+        if family(name) != current:
+            current = family(name)
+            kind, help_text = METRICS.get(current, ('untyped', ''))
+            lines.append(f'# HELP {current} {help_text}')
+            lines.append(f'# TYPE {current} {kind}')
+        lines.append(
+            f'{name}{{{label}}} {format_value(value)}' if label
+            else f'{name} {format_value(value)}'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+@never_cache
+@require_GET
+def metrics_view(request):
+    """Метрики всех процессов хоста."""
+    process_metrics.flush()
+    counters, gauges = get_store().load()
+    return HttpResponse(
+        render(counters, gauges),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+class ObservedContent:
+    """Тело потокового ответа, по окончании отдачи вызывающее ``done``.
+
+    ``close`` вызывается сервером и тогда, когда клиент не дочитал ответ.
+    """
+
+    def __init__(self, content, done):
+        self.content = content
+        self.done = done
+
+    def close(self):
+        """Сообщить об окончании отдачи один раз."""
+        done, self.done = self.done, None
+        if done is not None:
+            done()
+
+
+class ObservedStream(ObservedContent):
+    """Синхронное тело потокового ответа."""
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+
+class AsyncObservedStream(ObservedContent):
+    """Асинхронное тело потокового ответа.
+
+    ``__iter__`` здесь нет: ``StreamingHttpResponse`` считает тело
+    синхронным, если для него работает ``iter()``.
+    """
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+class MetricsMiddleware:
+    """Счётчики и время запросов по действиям вьюсетов.
+
+    Для потоковых ответов время считается до конца отдачи тела.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        atexit.unregister(process_metrics.flush)
+        atexit.register(process_metrics.flush)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        process_metrics.start_flusher()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        return self.observe(request, response, started)
+
+    async def __acall__(self, request):
+        process_metrics.start_flusher()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.observe(request, response, started)
+
+    def observe(self, request, response, started):
+        """Учесть запрос сразу или, для потокового ответа, после отдачи."""
+        def done():
+            self.record(request, response, time.perf_counter() - started)
+
+        if not response.streaming:
+            done()
+        elif response.is_async:
+            response.streaming_content = AsyncObservedStream(
+                response.streaming_content, done
+            )
+        else:
+            response.streaming_content = ObservedStream(
+                response.streaming_content, done
+            )
+        return response
+
+    def record(self, request, response, seconds):
+        """Учесть запрос."""
+        view = view_name(request) or 'unresolved'
+        method = request.method if request.method in HTTP_METHODS else (
+            'other'
+        )
+        process_metrics.inc(
+            'foodgram_http_requests_total',
+            labels(view=view, method=method, status=response.status_code),
+        )
+        process_metrics.observe(
+            'foodgram_http_request_duration_seconds',
+            labels(view=view, method=method), seconds,
+        )
@@ -0,0 +1,24 @@
+import time
+
+from django.db.backends.postgresql import base
+
+from backend.db_stats import connection_stats
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с учётом времени подключения и открытых соединений."""
+
+    def get_new_connection(self, conn_params):
+        """Открыть соединение, замерив время установки."""
+        started = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        connection_stats.connected(
+            self.alias, time.perf_counter() - started
+        )
+        return connection
+
+    def _close(self):
+        """Закрыть соединение и учесть это в статистике."""
+        if self.connection is not None:
+            connection_stats.closed(self.alias)
+        super()._close()
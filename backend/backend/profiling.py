@@ -0,0 +1,193 @@
+"""Профилирование запросов: SQL, время базы и рендеринга.
+
+Профилируется доля ``PROFILER_SAMPLE_RATE`` запросов. Для них все
+SQL-запросы во всех соединениях, в том числе в потоках асинхронного
+чтения, учитываются через ``execute_wrapper``, а итог отдаётся в
+заголовке ``Server-Timing`` и одной строкой JSON в лог
+``backend.profiling``. Остальные запросы платят только за чтение
+``ContextVar`` на каждый SQL-запрос.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    """Счётчики одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.sections = Counter()
+
+    def record_query(self, sql, seconds):
+        """Учесть выполненный SQL-запрос."""
+        self.queries += 1
+        self.db_time += seconds
+        self.statements[sql] += 1
+
+    def repeated(self):
+        """Запросы, выполненные больше одного раза, от частых к редким."""
+        return [
+            (sql, count) for sql, count in self.statements.most_common()
+            if count > 1
+        ]
+
+    def timings(self):
+        """Время по частям запроса в миллисекундах."""
+        total = time.perf_counter() - self.started
+        sections = {
+            name: seconds * 1000 for name, seconds in self.sections.items()
+        }
+        return {
+            'total': total * 1000,
+            'db': self.db_time * 1000,
+            'app': max(
+                total - self.db_time - sum(self.sections.values()), 0
+            ) * 1000,
+            **sections,
+        }
+
+    def server_timing(self, timings):
+        """Значение заголовка Server-Timing."""
+        repeated = sum(count - 1 for _, count in self.repeated())
+        metrics = [
+            f'db;dur={timings["db"]:.1f};'
+            f'desc="{self.queries} queries, {repeated} repeated"'
+        ]
+        metrics.extend(
+            f'{name};dur={value:.1f}' for name, value in timings.items()
+            if name != 'db'
+        )
+        return ', '.join(metrics)
+
+
+@contextmanager
+def profile_section(name):
+    """Учесть время блока в профиле текущего запроса."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+
+
+def record_query(execute, sql, params, many, context):
+    """Обёртка выполнения SQL, пишущая в профиль текущего запроса."""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    """Подключить учёт SQL к соединению."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def view_name(request):
+    """Имя вьюхи вида ``RecipeViewSet.list``."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if view is None:
+        return match.view_name
+    if actions:
+        action = actions.get(request.method.lower())
+        if action is None and request.method == 'HEAD':
+            action = actions.get('get')
+        return f'{view.__name__}.{action}'
+    return view.__name__
+
+
+class ProfilingMiddleware:
+    """Профиль для выборки запросов: заголовок и строка лога."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.report(request, response, profile)
+
+    def sampled(self):
+        """Попадает ли запрос в выборку."""
+        rate = settings.PROFILER_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    def report(self, request, response, profile):
+        """Добавить Server-Timing и записать профиль в лог."""
+        timings = profile.timings()
+        response['Server-Timing'] = profile.server_timing(timings)
+        logger.info(json.dumps({
+            'view': view_name(request),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.queries,
+            **{
+                f'{name}_ms': round(value, 1)
+                for name, value in timings.items()
+            },
+            'repeated': [
+                {'sql': sql[:settings.PROFILER_SQL_LENGTH], 'count': count}
+                for sql, count in profile.repeated()[:5]
+            ],
+        }, ensure_ascii=False))
+        return response
@@ -0,0 +1,134 @@
+"""Чтение с реплик базы данных.
+
+Безопасные запросы читают с одной из реплик из ``DATABASE_REPLICAS``,
+всё остальное идёт в основную базу. После записи клиент на
+``REPLICA_PIN_SECONDS`` закрепляется за основной базой, чтобы сразу
+видеть свои изменения, даже если реплика отстаёт. Клиентов с токеном
+закрепление находит в кэше, поэтому с репликами нужен общий для всех
+воркеров кэш.
+"""
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_primary_pin'
+PIN_KEY = 'db-primary-pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def pin_key(request):
+    """Ключ закрепления по заголовку авторизации или None."""
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return PIN_KEY.format(hashlib.sha256(authorization.encode()).hexdigest())
+
+
+class ReplicaRouter:
+    """Чтение с реплик внутри запросов, запись в основную базу."""
+
+    def db_for_read(self, model, **hints):
+        """Случайная реплика, если запрос разрешает чтение с неё."""
+        if (
+            not read_from_replica.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        """Запись только в основную базу."""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Реплики содержат те же данные, что и основная база."""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Миграции применяются только к основной базе."""
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    """Выбор базы для чтения на время запроса.
+
+    Работает и в синхронной, и в асинхронной цепочке, чтобы под ASGI не
+    переводить запрос в единственный синхронный поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.DATABASE_REPLICAS and not settings.SHARED_CACHE:
+            raise ImproperlyConfigured(
+                'DB_REPLICA_HOSTS: закрепление клиентов с токеном за '
+                'основной базой хранится в кэше, нужен общий для воркеров '
+                'CACHE_BACKEND, а не кэш в памяти процесса.'
+            )
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        token = read_from_replica.set(self.use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        use_replica = await sync_to_async(
+            self.use_replica, thread_sensitive=False
+        )(request)
+        token = read_from_replica.set(use_replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return await sync_to_async(
+            self.process_response, thread_sensitive=False
+        )(request, response)
+
+    def use_replica(self, request):
+        """Можно ли читать с реплики в этом запросе."""
+        return request.method in SAFE_METHODS and not self.is_pinned(request)
+
+    def process_response(self, request, response):
+        """Закрепить клиента после успешной записи."""
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            self.pin(request, response)
+        return response
+
+    def is_pinned(self, request):
+        """Писал ли клиент недавно."""
+        if PIN_COOKIE in request.COOKIES:
+            return True
+        key = pin_key(request)
+        return key is not None and cache.get(key) is not None
+
+    def pin(self, request, response):
+        """Закрепить клиента за основной базой."""
+        timeout = settings.REPLICA_PIN_SECONDS
+        response.set_cookie(
+            PIN_COOKIE, '1', max_age=timeout, httponly=True, samesite='Lax'
+        )
+        key = pin_key(request)
+        if key is not None:
+            cache.set(key, True, timeout)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -35,9 +36,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
+    'backend.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'backend.replicas.ReplicaMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -70,15 +74,22 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.api_v1.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.api_v1.renderers.ProfiledJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.UserRateThrottle',
-        'rest_framework.throttling.AnonRateThrottle',
+        'api.api_v1.throttling.UserSlidingRateThrottle',
+        'api.api_v1.throttling.AnonSlidingRateThrottle',
+        'api.api_v1.throttling.ScopedSlidingRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'user': '10000/day',
         'anon': '1000/day',
+        'shopping_list': '60/hour',
+        'uploads': '60/hour',
     },
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -94,15 +105,123 @@ SIMPLE_JWT = {
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'backend.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'db'),
         'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', 'True'
+        ).lower() == 'true',
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        },
+    }
+}
+
+DB_SLOW_CONNECT_SECONDS = float(os.getenv('DB_SLOW_CONNECT_SECONDS', 0.1))
+
+DATABASE_REPLICAS = []
+
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1
+):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+RECIPE_FRAGMENT_CACHE_TIMEOUT = int(
+    os.getenv('RECIPE_FRAGMENT_CACHE_TIMEOUT', 300)
+)
+
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 600))
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'avif')
+
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+)
+
+FILE_UPLOAD_HANDLERS = ['api.api_v1.uploads.ImageUploadHandler']
+
+TOKEN_LOCAL_CACHE_SIZE = int(os.getenv('TOKEN_LOCAL_CACHE_SIZE', 1024))
+
+TOKEN_LOCAL_CACHE_TIMEOUT = int(os.getenv('TOKEN_LOCAL_CACHE_TIMEOUT', 30))
+
+TOKEN_SHARED_CACHE_TIMEOUT = int(os.getenv('TOKEN_SHARED_CACHE_TIMEOUT', 300))
+
+THROTTLE_STORE = os.getenv(
+    'THROTTLE_STORE', 'cache' if SHARED_CACHE else 'sqlite'
+)
+
+THROTTLE_SQLITE_PATH = os.getenv(
+    'THROTTLE_SQLITE_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram-throttle.sqlite3'),
+)
+
+METRICS_SQLITE_PATH = os.getenv(
+    'METRICS_SQLITE_PATH',
+    os.path.join(tempfile.gettempdir(), 'foodgram-metrics.sqlite3'),
+)
+
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0.01))
+
+PROFILER_SQL_LENGTH = 300
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'backend.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False').lower() == 'true'
+
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', 8))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -1,3 +1,4 @@
+from api.api_v1.async_views import async_read_urls
 from api.api_v1.views import (IngredientViewSet, RecipeViewSet, TagViewSet,
                               UserViewSet)
 from django.conf import settings
@@ -7,6 +8,8 @@ from django.urls import include, path
 from rest_framework.authtoken import views
 from rest_framework.routers import DefaultRouter
 
+from backend.metrics import metrics_view
+
 router = DefaultRouter()
 
 router.register(r'tags', TagViewSet, basename='tag')
@@ -14,11 +17,16 @@ router.register(r'recipes', RecipeViewSet, basename='recipes')
 router.register(r'users', UserViewSet, basename='users')
 router.register(r'ingredients', IngredientViewSet, basename='ingridients')
 
+api_urls = router.urls
+if settings.ASYNC_READ_VIEWS:
+    api_urls = async_read_urls(api_urls)
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include(router.urls)),
+    path('api/', include(api_urls)),
     path('api/auth/', include('djoser.urls.authtoken')),
     path('api-token-auth/', views.obtain_auth_token),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
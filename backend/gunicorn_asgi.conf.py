@@ -0,0 +1,11 @@
+"""Профиль gunicorn с воркерами uvicorn и асинхронным чтением."""
+import os
+
+bind = '0.0.0.0:8000'
+wsgi_app = 'backend.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+# Под ASGI запросы обслуживаются в разных потоках, а постоянное соединение
+# привязано к потоку и закрывается только в нём, поэтому соединения с
+# базой открываются заново на каждый запрос.
+raw_env = ['ASYNC_READ_VIEWS=True', 'DB_CONN_MAX_AGE=0']
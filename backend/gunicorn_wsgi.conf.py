@@ -0,0 +1,6 @@
+"""Профиль gunicorn с синхронными воркерами WSGI."""
+import os
+
+bind = '0.0.0.0:8000'
+wsgi_app = 'backend.wsgi'
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import shopping_totals
 from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tags
 
 
@@ -19,7 +20,7 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count')
     search_fields = ('name', 'author__username')
     list_filter = ('tags',)
 
@@ -28,6 +29,25 @@ class RecipeAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'user')
 
+    def save_model(self, request, obj, form, change):
+        """Сохранить корзину и пересчитать итоги пользователей."""
+        user_ids = {obj.user_id}
+        if change:
+            user_ids.add(ShoppingCart.objects.get(pk=obj.pk).user_id)
+        super().save_model(request, obj, form, change)
+        shopping_totals.rebuild(user_ids)
+
+    def delete_model(self, request, obj):
+        """Удалить из корзины с учётом итогов."""
+        shopping_totals.remove_recipe(obj.user, obj.recipe)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        """Удалить записи корзин и пересчитать итоги пользователей."""
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        shopping_totals.rebuild(user_ids)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def restore_search_index(sender, using, **kwargs):
+    """Восстановить поисковые триггеры после миграций."""
+    from .search import install_search_index
+
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        install_search_index(connection)
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        post_migrate.connect(restore_search_index, sender=self)
@@ -0,0 +1,205 @@
+"""Уменьшенные копии изображений рецептов и аватаров.
+
+Копии нескольких ширин в WebP (и AVIF, если его поддерживает Pillow)
+строятся в пуле потоков после фиксации транзакции. Имена файлов
+сохраняются в поле ``<поле>_variants`` вместе с именем исходника, поэтому
+набор, построенный для прежнего файла, сразу отличим от актуального.
+Файлы прежнего набора удаляются при замене, очистке и удалении объекта.
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+FORMAT_OPTIONS = {
+    'webp': {'quality': 80, 'method': 4},
+    'avif': {'quality': 60},
+}
+
+executor = None
+
+
+def get_executor():
+    """Общий пул потоков процесса."""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            thread_name_prefix='image-derivatives',
+        )
+    return executor
+
+
+def supported_formats():
+    """Форматы из настроек, которые умеет сохранять Pillow."""
+    Image.init()
+    return [
+        fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS
+        if fmt.upper() in Image.SAVE
+    ]
+
+
+def variants_field(field):
+    """Имя поля с копиями изображения."""
+    return f'{field}_variants'
+
+
+def is_current(instance, field):
+    """Построены ли копии для текущего файла."""
+    image = getattr(instance, field)
+    variants = getattr(instance, variants_field(field))
+    return bool(image) and variants.get('source') == image.name
+
+
+def variant_urls(instance, field):
+    """Адреса актуальных копий вида {ширина: {формат: url}}."""
+    if not is_current(instance, field):
+        return {}
+    return {
+        width: {
+            fmt: default_storage.url(name) for fmt, name in formats.items()
+        }
+        for width, formats in getattr(
+            instance, variants_field(field)
+        )['sizes'].items()
+    }
+
+
+def derivative_name(source, width, fmt):
+    """Имя файла копии рядом с именем исходника."""
+    return str(
+        PurePosixPath(DERIVATIVES_DIR)
+        / PurePosixPath(source).with_suffix('') / f'{width}.{fmt}'
+    )
+
+
+def derivative_widths(source_width):
+    """Ширины копий не больше исходника.
+
+    Копии не увеличиваются, поэтому ширины больше исходной заменяются
+    одной копией в размер исходника.
+    """
+    widths = [
+        width for width in settings.IMAGE_DERIVATIVE_WIDTHS
+        if width < source_width
+    ]
+    if len(widths) < len(settings.IMAGE_DERIVATIVE_WIDTHS):
+        widths.append(source_width)
+    return widths
+
+
+def variant_names(variants):
+    """Имена файлов копий из их описания."""
+    return {
+        name
+        for formats in variants.get('sizes', {}).values()
+        for name in formats.values()
+    }
+
+
+def delete_derivatives(variants, keep=()):
+    """Удалить файлы копий, кроме перечисленных в ``keep``."""
+    for name in variant_names(variants) - set(keep):
+        default_storage.delete(name)
+
+
+def discard_derivatives(instance, field):
+    """Удалить копии объекта после фиксации транзакции."""
+    variants = getattr(instance, variants_field(field))
+    if variants:
+        transaction.on_commit(lambda: delete_derivatives(variants))
+
+
+def render_derivatives(source):
+    """Построить и сохранить копии файла, вернуть их описание."""
+    with default_storage.open(source) as file:
+        original = ImageOps.exif_transpose(Image.open(file))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert(
+            'RGBA' if 'transparency' in original.info
+            or original.mode in ('LA', 'PA') else 'RGB'
+        )
+    formats = supported_formats()
+    sizes = {}
+    for width in derivative_widths(original.width):
+        image = original.copy()
+        image.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+        sizes[str(width)] = {}
+        for fmt in formats:
+            buffer = io.BytesIO()
+            image.save(buffer, fmt.upper(), **FORMAT_OPTIONS.get(fmt, {}))
+            name = derivative_name(source, width, fmt)
+            default_storage.delete(name)
+            sizes[str(width)][fmt] = default_storage.save(
+                name, ContentFile(buffer.getvalue())
+            )
+    return {'source': source, 'sizes': sizes}
+
+
+def build_derivatives(model, pk, field, source, touch):
+    """Построить копии и записать их, если файл объекта не сменился.
+
+    ``touch`` — условия для рецептов, чья версия зависит от изображения.
+    Копии прежнего файла удаляются, а если файл объекта уже сменился,
+    удаляются только что построенные.
+    """
+    variants = render_derivatives(source)
+    with transaction.atomic():
+        previous = model.objects.select_for_update().filter(
+            pk=pk, **{field: source}
+        ).values_list(variants_field(field), flat=True).first()
+        if previous is not None:
+            model.objects.filter(pk=pk).update(
+                **{variants_field(field): variants}
+            )
+    if previous is None:
+        delete_derivatives(variants)
+        return False
+    delete_derivatives(previous, keep=variant_names(variants))
+    Recipe.objects.touch(**touch)
+    return True
+
+
+def build_in_worker(*args):
+    """Построить копии в потоке пула."""
+    try:
+        build_derivatives(*args)
+    except Exception:
+        logger.exception('Не удалось построить копии изображения %s', args)
+    finally:
+        connections.close_all()
+
+
+def refresh_derivatives(instance, field, touch):
+    """Перестроить копии, если они построены не для текущего файла."""
+    if is_current(instance, field):
+        return
+    model = type(instance)
+    image = getattr(instance, field)
+    if not image:
+        if getattr(instance, variants_field(field)):
+            model.objects.filter(pk=instance.pk).update(
+                **{variants_field(field): {}}
+            )
+            Recipe.objects.touch(**touch)
+            discard_derivatives(instance, field)
+        return
+    args = (model, instance.pk, field, image.name, touch)
+    if settings.IMAGE_DERIVATIVE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(build_in_worker, *args)
+        )
+    else:
+        transaction.on_commit(lambda: build_derivatives(*args))
@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+import sys
+import time
+import types
+
+from api.api_v1.async_views import async_read_urls
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, override_settings
+from django.urls import clear_url_caches, include, path
+
+from backend.urls import router
+
+BENCHMARK_URLCONF = 'benchmark_async_reads_urls'
+
+
+def build_urlconf(async_reads):
+    """Модуль маршрутов API с синхронными или асинхронными вьюхами."""
+    urls = router.urls
+    if async_reads:
+        urls = async_read_urls(urls)
+    module = types.ModuleType(BENCHMARK_URLCONF)
+    module.urlpatterns = [path('api/', include(urls))]
+    sys.modules[BENCHMARK_URLCONF] = module
+    clear_url_caches()
+
+
+def percentile(values, share):
+    """Значение, ниже которого лежит доля ``share`` выборки."""
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнить синхронные и асинхронные вьюхи чтения под ASGI '
+        'при медленной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Адрес для запросов, можно указать несколько раз.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Количество запросов в каждом режиме.'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=50,
+            help='Количество одновременных клиентов.'
+        )
+        parser.add_argument(
+            '--query-latency', type=float, default=0.02,
+            help='Искусственная задержка каждого SQL-запроса в секундах.'
+        )
+
+    def handle(self, *args, paths, requests, concurrency, query_latency,
+               **options):
+        paths = paths or ['/api/recipes/', '/api/tags/', '/api/ingredients/']
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(query_latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(connection, **kwargs):
+            if slow_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_query)
+
+        connection_created.connect(add_latency)
+        try:
+            with override_settings(
+                ROOT_URLCONF=BENCHMARK_URLCONF, ALLOWED_HOSTS=['*']
+            ):
+                for mode in ('sync', 'async'):
+                    build_urlconf(mode == 'async')
+                    elapsed, timings = asyncio.run(
+                        self.run(paths, requests, concurrency)
+                    )
+                    self.report(mode, elapsed, timings)
+        finally:
+            connection_created.disconnect(add_latency)
+            sys.modules.pop(BENCHMARK_URLCONF, None)
+            clear_url_caches()
+
+    async def run(self, paths, requests, concurrency):
+        """Выполнить запросы с ограничением одновременности."""
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def fetch(number):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(
+                    paths[number % len(paths)],
+                    REMOTE_ADDR=f'10.0.{number // 250}.{number % 250 + 1}',
+                )
+                timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(
+                        f'{response.status_code} {response.content[:200]}'
+                    )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fetch(number) for number in range(requests)))
+        return time.perf_counter() - started, timings
+
+    def report(self, mode, elapsed, timings):
+        """Вывести пропускную способность и задержки режима."""
+        self.stdout.write(
+            f'{mode:>5}: {len(timings) / elapsed:8.1f} запросов/с, '
+            f'p50 {statistics.median(timings) * 1000:7.1f} мс, '
+            f'p99 {percentile(timings, 0.99) * 1000:7.1f} мс'
+        )
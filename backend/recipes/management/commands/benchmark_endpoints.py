@@ -0,0 +1,327 @@
+import base64
+import json
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from unittest import mock
+
+from api.api_v1.throttling import SlidingWindowRateThrottle
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import resolve
+from recipes.management.commands.benchmark_async_reads import percentile
+from recipes.management.commands.generate_dataset import (PASSWORD,
+                                                          USERNAME_PREFIX,
+                                                          image_content)
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tags
+from rest_framework.authtoken.models import Token
+from users.models import Follow
+
+from backend.profiling import RequestProfile, current_profile
+from backend.urls import router
+
+User = get_user_model()
+
+Step = namedtuple(
+    'Step', 'variant client method path data', defaults=(None,)
+)
+
+
+def step_name(step):
+    """Действие вьюсета и вариант запроса: ``RecipeViewSet.list anon``."""
+    match = resolve(step.path.split('?')[0])
+    action = match.func.actions[step.method]
+    name = f'{match.func.cls.__name__}.{action} {step.method.upper()}'
+    return f'{name} {step.variant}' if step.variant else name
+
+
+def router_actions():
+    """Все пары (маршрут, метод) роутера API, кроме HEAD, равного GET."""
+    return {
+        (url.name, method)
+        for url in router.urls
+        if getattr(url.callback, 'actions', None)
+        for method in url.callback.actions
+        if method != 'head'
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогнать все эндпоинты роутера через тестовый клиент на данных '
+        'generate_dataset и вывести задержки, число SQL-запросов и '
+        'выделения памяти.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=30,
+            help='Количество замеряемых прогонов сценария.'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Прогоны для прогрева кэшей, не попадающие в замеры.'
+        )
+        parser.add_argument(
+            '--alloc-iterations', type=int, default=3,
+            help='Прогоны под tracemalloc для замера выделений памяти.'
+        )
+        parser.add_argument(
+            '--output', help='Сохранить результаты в json-файл.'
+        )
+        parser.add_argument(
+            '--baseline', help='json-файл прошлого запуска для сравнения.'
+        )
+
+    def handle(self, *args, iterations, warmup, alloc_iterations, output,
+               baseline, **options):
+        self.prepare()
+        self.created = 0
+        results = defaultdict(lambda: defaultdict(list))
+        self.covered = set()
+        # Без DEBUG, который сохраняет все SQL-запросы, и без лимитов
+        # частоты, иначе прогоны упрутся в 429. Копии изображений строятся
+        # в самом запросе, чтобы фоновые потоки не искажали другие замеры.
+        with override_settings(
+            DEBUG=False, ALLOWED_HOSTS=['*'], PROFILER_SAMPLE_RATE=0,
+            IMAGE_DERIVATIVE_WORKERS=0,
+        ), mock.patch.object(
+            SlidingWindowRateThrottle, 'allow_request', return_value=True
+        ):
+            for _ in range(warmup):
+                self.run_scenario(lambda step, send: send())
+            for _ in range(iterations):
+                self.run_scenario(
+                    lambda step, send: self.measure(results, step, send)
+                )
+            tracemalloc.start()
+            try:
+                for _ in range(alloc_iterations):
+                    self.run_scenario(
+                        lambda step, send: self.allocations(
+                            results, step, send
+                        )
+                    )
+            finally:
+                tracemalloc.stop()
+        report = {
+            name: {
+                'p50_ms': statistics.median(values['latency']),
+                'p99_ms': percentile(values['latency'], 0.99),
+                'queries': statistics.median(values['queries']),
+                'db_ms': statistics.median(values['db']),
+                'peak_kib': (
+                    max(values['peak']) / 1024 if values['peak'] else None
+                ),
+            }
+            for name, values in results.items()
+        }
+        previous = {}
+        if baseline:
+            with open(baseline, encoding='utf-8') as file:
+                previous = json.load(file)
+        self.print_report(report, previous)
+        missing = router_actions() - self.covered
+        for name, method in sorted(missing):
+            self.stdout.write(self.style.WARNING(
+                f'Не замерялось: {method.upper()} {name}'
+            ))
+        if output:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def prepare(self):
+        """Пользователь, объекты для сценария и клиенты."""
+        self.user = User.objects.filter(
+            username=f'{USERNAME_PREFIX}0'
+        ).first()
+        if self.user is None:
+            raise CommandError('Сначала выполните generate_dataset.')
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.clients = {
+            'anon': Client(),
+            'user': Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+        }
+        self.tag = Tags.objects.order_by('id').first()
+        self.tags = list(Tags.objects.order_by('id').values_list(
+            'id', flat=True
+        )[:2])
+        self.ingredient = Ingredient.objects.order_by('name').first()
+        self.recipe = Recipe.objects.exclude(
+            favorited_by__user=self.user
+        ).exclude(cart__user=self.user).order_by('id').first()
+        self.author = User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).exclude(pk=self.user.pk).exclude(
+            followers__user=self.user
+        ).order_by('id').first()
+        image = image_content().read()
+        self.image = (
+            'data:image/png;base64,' + base64.b64encode(image).decode()
+        )
+        Favorite.objects.filter(user=self.user, recipe=self.recipe).delete()
+        ShoppingCart.objects.filter(
+            user=self.user, recipe=self.recipe
+        ).delete()
+        Follow.objects.filter(user=self.user, following=self.author).delete()
+
+    def recipe_payload(self, name):
+        """Данные рецепта для создания и изменения."""
+        return {
+            'name': name,
+            'text': 'Рецепт для замеров.',
+            'cooking_time': 30,
+            'image': self.image,
+            'tags': self.tags,
+            'ingredients': [{'id': self.ingredient.id, 'amount': 100}],
+        }
+
+    def scenario(self):
+        """Запросы ко всем эндпоинтам; ответ приходит в ``yield``."""
+        recipe = f'/api/recipes/{self.recipe.id}'
+        author = f'/api/users/{self.author.id}'
+        yield Step(None, 'anon', 'get', '/api/tags/')
+        yield Step(None, 'anon', 'get', f'/api/tags/{self.tag.id}/')
+        yield Step(None, 'anon', 'get', '/api/ingredients/?name=са')
+        yield Step(
+            None, 'anon', 'get', f'/api/ingredients/{self.ingredient.id}/'
+        )
+        yield Step('anon', 'anon', 'get', '/api/recipes/')
+        yield Step(
+            'tags', 'user', 'get',
+            f'/api/recipes/?tags={self.tag.slug}&page=2',
+        )
+        yield Step('favorited', 'user', 'get', '/api/recipes/?is_favorited=1')
+        yield Step(None, 'anon', 'get', f'{recipe}/')
+        yield Step(None, 'anon', 'get', f'{recipe}/get-link/')
+        yield Step(None, 'user', 'post', f'{recipe}/favorite/')
+        yield Step(None, 'user', 'delete', f'{recipe}/favorite/')
+        yield Step(None, 'user', 'post', f'{recipe}/shopping_cart/')
+        yield Step(None, 'user', 'get', '/api/recipes/shopping_list/')
+        yield Step(
+            None, 'user', 'get', '/api/recipes/download_shopping_cart/'
+        )
+        yield Step(None, 'user', 'delete', f'{recipe}/shopping_cart/')
+        response = yield Step(
+            None, 'user', 'post', '/api/recipes/',
+            self.recipe_payload('Новый рецепт'),
+        )
+        created = f'/api/recipes/{response.json()["id"]}/'
+        yield Step(
+            None, 'user', 'put', created, self.recipe_payload('Замена')
+        )
+        yield Step(None, 'user', 'patch', created, {'cooking_time': 45})
+        yield Step(None, 'user', 'delete', created)
+        yield Step(None, 'anon', 'get', '/api/users/')
+        yield Step(None, 'anon', 'get', f'{author}/')
+        yield Step(None, 'user', 'get', '/api/users/me/')
+        yield Step(
+            None, 'user', 'get', '/api/users/subscriptions/?recipes_limit=3'
+        )
+        yield Step(None, 'user', 'post', f'{author}/subscribe/')
+        yield Step(None, 'user', 'delete', f'{author}/subscribe/')
+        yield Step(
+            None, 'user', 'put', '/api/users/me/avatar/',
+            {'avatar': self.image},
+        )
+        yield Step(None, 'user', 'delete', '/api/users/me/avatar/')
+        yield Step(
+            None, 'user', 'post', '/api/users/set_password/',
+            {'current_password': PASSWORD, 'new_password': PASSWORD},
+        )
+        self.created += 1
+        username = f'{USERNAME_PREFIX}benchmark_{self.created}'
+        response = yield Step(None, 'anon', 'post', '/api/users/', {
+            'email': f'{username}@example.com',
+            'username': username,
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'password': PASSWORD,
+        })
+        created = f'/api/users/{response.json()["id"]}/'
+        yield Step(None, 'user', 'put', created, {
+            'email': f'{username}@example.com',
+            'username': username,
+            'first_name': 'Другое имя',
+            'last_name': 'Фамилия',
+        })
+        yield Step(None, 'user', 'patch', created, {'last_name': 'Другая'})
+        yield Step(None, 'user', 'delete', created)
+
+    def run_scenario(self, handle):
+        """Пройти сценарий, передав каждый запрос в ``handle``."""
+        scenario = self.scenario()
+        response = None
+        while True:
+            try:
+                step = scenario.send(response)
+            except StopIteration:
+                return
+            response = handle(step, lambda: self.send(step))
+
+    def send(self, step):
+        """Выполнить запрос и дочитать ответ."""
+        kwargs = {}
+        if step.data is not None:
+            kwargs = {'data': step.data, 'content_type': 'application/json'}
+        response = getattr(self.clients[step.client], step.method)(
+            step.path, **kwargs
+        )
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{step.method.upper()} {step.path}: '
+                f'{response.status_code} {response.content[:300]}'
+            )
+        match = resolve(step.path.split('?')[0])
+        self.covered.add((match.url_name, step.method))
+        return response
+
+    def measure(self, results, step, send):
+        """Замерить время и SQL-запросы."""
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = send()
+        finally:
+            elapsed = time.perf_counter() - started
+            current_profile.reset(token)
+        values = results[step_name(step)]
+        values['latency'].append(elapsed * 1000)
+        values['queries'].append(profile.queries)
+        values['db'].append(profile.db_time * 1000)
+        return response
+
+    def allocations(self, results, step, send):
+        """Замерить пик выделенной за запрос памяти."""
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        response = send()
+        results[step_name(step)]['peak'].append(
+            tracemalloc.get_traced_memory()[1] - before
+        )
+        return response
+
+    def print_report(self, report, previous):
+        """Таблица результатов и изменение p50 относительно прошлого."""
+        self.stdout.write(
+            f'{"эндпоинт":<48} {"p50 мс":>8} {"p99 мс":>8} '
+            f'{"SQL":>5} {"БД мс":>7} {"пик КиБ":>8}'
+        )
+        for name, row in report.items():
+            peak = row['peak_kib']
+            line = (
+                f'{name:<48} {row["p50_ms"]:8.2f} {row["p99_ms"]:8.2f} '
+                f'{row["queries"]:5g} {row["db_ms"]:7.2f} '
+                f'{peak if peak is not None else 0:8.1f}'
+            )
+            if name in previous:
+                change = row['p50_ms'] / previous[name]['p50_ms'] - 1
+                line += f' {change:+.0%}'
+                if row['queries'] != previous[name]['queries']:
+                    line += f' SQL было {previous[name]["queries"]:g}'
+            self.stdout.write(line)
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
+
+from backend.metrics import MetricsMiddleware
+
+CHUNKS = (b'first,', b'second,', b'third')
+
+
+async def async_chunks():
+    """Асинхронное тело ответа."""
+    for chunk in CHUNKS:
+        yield chunk
+
+
+async def collect(content):
+    """Прочитать асинхронное тело ответа."""
+    return b''.join([chunk async for chunk in content])
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверить, что MetricsMiddleware сохраняет тип потокового ответа '
+        'и учитывает запрос после отдачи тела.'
+    )
+
+    def handle(self, *args, **options):
+        for is_async in (False, True):
+            mode = 'async' if is_async else 'sync'
+            recorded = []
+            response = StreamingHttpResponse(
+                async_chunks() if is_async else iter(CHUNKS)
+            )
+            middleware = MetricsMiddleware(lambda request: response)
+            middleware.record = (
+                lambda request, response, seconds: recorded.append(seconds)
+            )
+            middleware.observe(
+                RequestFactory().get('/'), response, time.perf_counter()
+            )
+            if response.is_async != is_async:
+                raise CommandError(
+                    f'{mode}: тело ответа стало '
+                    f'{"асинхронным" if response.is_async else "синхронным"}'
+                )
+            if recorded:
+                raise CommandError(f'{mode}: запрос учтён до отдачи тела')
+            if is_async:
+                body = asyncio.run(collect(response.streaming_content))
+            else:
+                body = b''.join(response.streaming_content)
+            if body != b''.join(CHUNKS) or len(recorded) != 1:
+                raise CommandError(
+                    f'{mode}: тело {body!r}, учтено запросов {len(recorded)}'
+                )
+            self.stdout.write(f'{mode}: тело отдано, запрос учтён')
+        self.stdout.write(self.style.SUCCESS('Потоковые ответы учитываются'))
@@ -0,0 +1,248 @@
+import io
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+from recipes import shopping_totals
+from recipes.models import (ContentVersion, Favorite, Ingredient,
+                            IngredientAmount, Recipe, ShoppingCart, Tags)
+from users.models import Follow
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'generated_'
+PASSWORD = 'generated-password'
+IMAGE_NAME = 'recipes/images/generated.png'
+TAGS = (
+    ('Завтрак', 'breakfast', 4),
+    ('Обед', 'lunch', 5),
+    ('Ужин', 'dinner', 5),
+    ('Выпечка', 'baking', 2),
+    ('Десерт', 'dessert', 2),
+    ('Салат', 'salad', 2),
+    ('Суп', 'soup', 2),
+    ('Вегетарианское', 'vegetarian', 1),
+)
+DISHES = (
+    'салат', 'суп', 'рагу', 'пирог', 'омлет', 'запеканка', 'паста',
+    'каша', 'котлеты', 'плов', 'блины', 'соус', 'торт', 'гратен',
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'летний', 'острый', 'сытный', 'праздничный',
+    'лёгкий', 'бабушкин', 'пряный', 'простой',
+)
+AMOUNTS = {
+    'г': (10, 1000, 10),
+    'мл': (50, 1000, 50),
+    'шт.': (1, 12, 1),
+}
+DEFAULT_AMOUNT = (1, 5, 1)
+
+
+def zipf_weights(count, exponent=1.1):
+    """Веса популярности: первые объекты встречаются намного чаще."""
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def sample_distinct(rng, population, weights, count):
+    """Выбрать ``count`` разных объектов с учётом весов."""
+    count = min(count, len(population))
+    chosen = {}
+    while len(chosen) < count:
+        for item in rng.choices(population, weights, k=count - len(chosen)):
+            chosen.setdefault(item.pk, item)
+    return list(chosen.values())
+
+
+def amount_for(rng, unit):
+    """Правдоподобное количество ингредиента для единицы измерения."""
+    low, high, step = AMOUNTS.get(unit.strip(), DEFAULT_AMOUNT)
+    return rng.randrange(low, high + 1, step)
+
+
+def image_content():
+    """Небольшое PNG-изображение для всех рецептов."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (214, 140, 69)).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue())
+
+
+class Command(BaseCommand):
+    help = (
+        'Создать воспроизводимый набор данных: пользователей, рецепты, '
+        'подписки, избранное и корзины. Данные прошлого запуска '
+        'удаляются. Копии изображений не строятся, для них есть '
+        'regenerate_image_derivatives.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=200,
+            help='Количество пользователей.'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=2000,
+            help='Количество рецептов.'
+        )
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='Среднее количество подписок пользователя.'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Среднее количество рецептов в избранном.'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=3,
+            help='Среднее количество рецептов в корзине.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Зерно генератора случайных чисел.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество объектов в одном INSERT.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        with transaction.atomic():
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            tags = self.create_tags()
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, tags, options['recipes'])
+            follows = self.link(
+                Follow, users, users, 'user', 'following', options['follows']
+            )
+            favorites = self.link(
+                Favorite, users, recipes, 'user', 'recipe',
+                options['favorites'],
+            )
+            carts = self.link(
+                ShoppingCart, users, recipes, 'user', 'recipe',
+                options['cart'],
+            )
+            shopping_totals.rebuild(user.id for user in users)
+            ContentVersion.objects.bump(ContentVersion.RECIPES)
+        call_command('reconcile_counters', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей {len(users)}, рецептов {len(recipes)}, '
+            f'подписок {follows}, в избранном {favorites}, '
+            f'в корзинах {carts} за {time.monotonic() - started:.1f} с'
+        ))
+
+    def create_tags(self):
+        """Теги с весами популярности."""
+        tags = []
+        for name, slug, weight in TAGS:
+            tag, _ = Tags.objects.get_or_create(
+                slug=slug, defaults={'name': name}
+            )
+            tags.append((tag, weight))
+        return tags
+
+    def create_users(self, count):
+        """Пользователи с общим паролем ``PASSWORD``."""
+        password = make_password(PASSWORD)
+        return User.objects.bulk_create(
+            [
+                User(
+                    username=f'{USERNAME_PREFIX}{number}',
+                    email=f'{USERNAME_PREFIX}{number}@example.com',
+                    first_name=f'Имя{number}',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                )
+                for number in range(count)
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def create_recipes(self, users, tags, count):
+        """Рецепты с тегами и ингредиентами.
+
+        Авторы, теги и ингредиенты выбираются по убывающей популярности:
+        у немногих авторов и ингредиентов большая часть рецептов.
+        """
+        rng = self.rng
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, image_content())
+        ingredients = list(Ingredient.objects.order_by('name'))
+        rng.shuffle(ingredients)
+        ingredient_weights = zipf_weights(len(ingredients))
+        author_weights = zipf_weights(len(users), 0.8)
+        tag_objects = [tag for tag, _ in tags]
+        tag_weights = [weight for _, weight in tags]
+        recipes = Recipe.objects.bulk_create(
+            [
+                Recipe(
+                    author=rng.choices(users, author_weights)[0],
+                    name=(
+                        f'{rng.choice(ADJECTIVES).capitalize()} '
+                        f'{rng.choice(DISHES)} №{number}'
+                    ),
+                    image=IMAGE_NAME,
+                    text=' '.join(
+                        rng.choices(DISHES + ADJECTIVES, k=rng.randint(20, 80))
+                    ),
+                    cooking_time=min(
+                        max(int(rng.lognormvariate(3.4, 0.6)), 5), 240
+                    ),
+                )
+                for number in range(count)
+            ],
+            batch_size=self.batch_size,
+        )
+        recipe_tags = []
+        amounts = []
+        for recipe in recipes:
+            for tag in sample_distinct(
+                rng, tag_objects, tag_weights, rng.randint(1, 3)
+            ):
+                recipe_tags.append(
+                    Recipe.tags.through(recipe_id=recipe.id, tags_id=tag.id)
+                )
+            for ingredient in sample_distinct(
+                rng, ingredients, ingredient_weights,
+                round(rng.triangular(2, 15, 6)),
+            ):
+                amounts.append(IngredientAmount(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=amount_for(rng, ingredient.measurement_unit),
+                ))
+        Recipe.tags.through.objects.bulk_create(
+            recipe_tags, batch_size=self.batch_size
+        )
+        IngredientAmount.objects.bulk_create(
+            amounts, batch_size=self.batch_size
+        )
+        return recipes
+
+    def link(self, model, users, targets, user_field, target_field, average):
+        """Связи пользователей с популярными объектами."""
+        rng = self.rng
+        weights = zipf_weights(len(targets))
+        rows = []
+        for user in users:
+            for target in sample_distinct(
+                rng, targets, weights, rng.randint(0, average * 2)
+            ):
+                if target.pk != user.pk or model is not Follow:
+                    rows.append(model(
+                        **{user_field: user, target_field: target}
+                    ))
+        model.objects.bulk_create(rows, batch_size=self.batch_size)
+        return len(rows)
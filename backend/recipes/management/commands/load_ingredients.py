@@ -0,0 +1,136 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from api.api_v1.autocomplete import invalidate_ingredient_index
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import Ingredient, Recipe
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data' / 'ingredients.csv'
+JSON_READ_SIZE = 64 * 1024
+
+
+def read_csv(path):
+    """Строки (название, единица измерения) из csv без заголовка."""
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    """Объекты из json-массива, разобранные по одному без загрузки файла."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    with open(path, encoding='utf-8') as file:
+        while True:
+            chunk = file.read(JSON_READ_SIZE)
+            buffer = buffer[position:] + chunk
+            position = 0
+            while True:
+                position = skip_separators(buffer, position)
+                if position == len(buffer):
+                    break
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise CommandError(f'Некорректный json: {path}')
+                    break
+                yield item['name'], item['measurement_unit']
+            if not chunk:
+                return
+
+
+def skip_separators(buffer, position):
+    """Пропустить скобки массива, запятые и пробелы."""
+    while position < len(buffer) and buffer[position] in '[], \t\r\n':
+        position += 1
+    return position
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+def batches(rows, size):
+    """Разбить поток строк на пачки без повторов названий."""
+    batch = {}
+    for name, unit in rows:
+        name, unit = name.strip(), unit.strip()
+        if not name:
+            continue
+        batch[name] = unit
+        if len(batch) == size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Загрузить справочник ингредиентов из csv или json.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(DEFAULT_PATH),
+            help='Файл с ингредиентами.'
+        )
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию берётся из расширения.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество ингредиентов в одном INSERT.'
+        )
+
+    def handle(self, *args, path, format, batch_size, **options):
+        path = Path(path)
+        file_format = format or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+        started = time.monotonic()
+        total = created = updated = 0
+        with transaction.atomic():
+            for batch in batches(READERS[file_format](path), batch_size):
+                total += len(batch)
+                existing = dict(
+                    Ingredient.objects.filter(name__in=batch)
+                    .values_list('name', 'measurement_unit')
+                )
+                changed = {
+                    name: unit for name, unit in batch.items()
+                    if existing.get(name) != unit
+                }
+                if not changed:
+                    continue
+                Ingredient.objects.bulk_create(
+                    [
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in changed.items()
+                    ],
+                    update_conflicts=True,
+                    unique_fields=('name',),
+                    update_fields=('measurement_unit',),
+                )
+                renamed = [name for name in changed if name in existing]
+                if renamed:
+                    Recipe.objects.touch(
+                        amount_ingredient__ingredient__name__in=renamed
+                    )
+                created += len(changed) - len(renamed)
+                updated += len(renamed)
+            if created or updated:
+                invalidate_ingredient_index()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано {total}, добавлено {created}, обновлено {updated}, '
+            f'без изменений {total - created - updated} '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import shopping_totals
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать итоги списков покупок пачками пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Количество пользователей в одной транзакции.'
+        )
+
+    def handle(self, *args, batch_size, **options):
+        total = 0
+        last_pk = 0
+        while True:
+            pks = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                shopping_totals.rebuild(pks)
+            total += len(pks)
+            last_pk = pks[-1]
+        self.stdout.write(f'Итоги списков покупок: пересчитано {total}')
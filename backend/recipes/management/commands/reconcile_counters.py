@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe
+from users.models import Follow
+
+User = get_user_model()
+
+
+def count_of(queryset, field):
+    """Подзапрос с количеством строк, ссылающихся на объект."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('id')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать денормализованные счётчики пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество объектов в одном UPDATE.'
+        )
+
+    def handle(self, *args, batch_size, **options):
+        counters = (
+            (Recipe, {'favorites_count': count_of(
+                Favorite.objects, 'recipe'
+            )}),
+            (User, {
+                'recipes_count': count_of(Recipe.objects, 'author'),
+                'followers_count': count_of(Follow.objects, 'following'),
+            }),
+        )
+        for model, expressions in counters:
+            total = 0
+            last_pk = 0
+            while True:
+                pks = list(
+                    model.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+                if not pks:
+                    break
+                model.objects.filter(pk__in=pks).update(**expressions)
+                total += len(pks)
+                last_pk = pks[-1]
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: пересчитано {total}'
+            )
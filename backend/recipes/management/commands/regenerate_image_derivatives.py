@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+from recipes.images import build_derivatives, is_current
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+def build(*args):
+    """Построить копии в потоке команды."""
+    try:
+        return build_derivatives(*args)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Построить уменьшенные копии изображений рецептов и аватаров.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить и актуальные копии.'
+        )
+        parser.add_argument(
+            '--workers', type=int,
+            default=max(settings.IMAGE_DERIVATIVE_WORKERS, 1),
+            help='Количество потоков.'
+        )
+
+    def handle(self, *args, force, workers, **options):
+        targets = (
+            (Recipe, 'image', lambda pk: {'pk': pk}),
+            (User, 'avatar', lambda pk: {'author_id': pk}),
+        )
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for model, field, touch in targets:
+                objects = model.objects.exclude(
+                    **{f'{field}__isnull': True}
+                ).exclude(**{field: ''}).only(
+                    'pk', field, f'{field}_variants'
+                )
+                for instance in objects.iterator():
+                    if not force and is_current(instance, field):
+                        continue
+                    name = getattr(instance, field).name
+                    future = pool.submit(
+                        build, model, instance.pk, field, name,
+                        touch(instance.pk)
+                    )
+                    futures[future] = name
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    built += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено копий: {built}, ошибок: {failed}'
+        ))
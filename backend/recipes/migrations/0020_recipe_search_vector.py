@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 20:05
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from recipes.search import install_search_index
+
+    install_search_index(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from recipes.search import uninstall_search_index
+
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
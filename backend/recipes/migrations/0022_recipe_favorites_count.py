@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 19:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    MyUser = apps.get_model('users', 'MyUser')
+    Recipe.objects.update(favorites_count=Coalesce(Subquery(
+        Favorite.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(count=Count('id')).values('count')
+    ), 0))
+    MyUser.objects.update(recipes_count=Coalesce(Subquery(
+        Recipe.objects.filter(author=OuterRef('pk')).order_by()
+        .values('author').annotate(count=Count('id')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_shoppinglistitem'),
+        ('users', '0013_myuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
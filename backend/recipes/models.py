@@ -1,11 +1,39 @@
+from uuid import uuid4
+
 from api.api_v1.constants import MAX_VALIDATED, MIN_VALIDATED
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
+from users.models import CounterFieldsMixin
 
 User = get_user_model()
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборка рецептов."""
+
+    def touch(self, **lookups):
+        """Обновить версию рецептов, попавших под условия."""
+        return self.filter(
+            pk__in=self.filter(**lookups).values('pk')
+        ).update(updated_at=timezone.now())
+
+    def update(self, **kwargs):
+        """Обновить рецепты и версию их списка."""
+        rows = super().update(**kwargs)
+        if rows:
+            ContentVersion.objects.bump(ContentVersion.RECIPES)
+        return rows
+
+    def search(self, query):
+        """Полнотекстовый поиск с ранжированием."""
+        from .search import search_recipes
+
+        return search_recipes(self, query)
+
+
 class Tags(models.Model):
     """Тэги."""
 
@@ -51,7 +79,7 @@ class Ingredient(models.Model):
         return f'{self.name} {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     """Рецепты."""
 
     author = models.ForeignKey(
@@ -62,6 +90,11 @@ class Recipe(models.Model):
     )
     name = models.CharField(max_length=200, verbose_name='Название',)
     image = models.ImageField(upload_to='recipes/images/')
+    image_variants = models.JSONField(
+        verbose_name='Копии изображения',
+        default=dict,
+        editable=False
+    )
     text = models.TextField()
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -75,11 +108,38 @@ class Recipe(models.Model):
         ]
     )
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(
+        verbose_name='Версия',
+        auto_now=True,
+        db_index=True
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name}'
@@ -146,6 +206,35 @@ class ShoppingCart(models.Model):
         verbose_name_plural = 'Списки покупок'
 
 
+class ShoppingListItem(models.Model):
+    """Итог ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items'
+    )
+    total_amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_ingredient_in_shopping_list'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.total_amount}'
+
+
 class IngredientAmount(models.Model):
     """Количество ингредиентов."""
 
@@ -178,3 +267,54 @@ class IngredientAmount(models.Model):
 
     def __str__(self):
         return f'{self.ingredient} {self.recipe}'
+
+
+class ContentVersionQuerySet(models.QuerySet):
+    """Версии данных."""
+
+    def bump(self, *keys):
+        """Выдать ключам новые версии."""
+        self.bulk_create(
+            [self.model(key=key, version=uuid4().hex) for key in keys],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['version'],
+        )
+
+    def read(self, *keys):
+        """Версии ключей одним запросом, у отсутствующих — None."""
+        versions = dict(
+            self.filter(key__in=keys).values_list('key', 'version')
+        )
+        return tuple(versions.get(key) for key in keys)
+
+
+class ContentVersion(models.Model):
+    """Версия данных для ETag.
+
+    Каждая запись выдаёт ключу новое случайное значение, поэтому версия
+    меняется и при одновременных записях, а читается по первичному ключу.
+    """
+
+    RECIPES = 'recipes'
+
+    key = models.CharField(
+        verbose_name='Ключ',
+        max_length=64,
+        primary_key=True
+    )
+    version = models.CharField(verbose_name='Версия', max_length=32)
+
+    objects = ContentVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.key} {self.version}'
+
+    @staticmethod
+    def user_key(user_id):
+        """Ключ версии избранного, покупок и подписок пользователя."""
+        return f'user:{user_id}'
@@ -0,0 +1,160 @@
+"""Полнотекстовый поиск рецептов.
+
+На PostgreSQL используется колонка ``search_vector`` с GIN-индексом и
+словарём ``russian``, на SQLite — таблица FTS5. В обоих случаях индекс
+поддерживается триггерами базы данных при каждой записи рецепта.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+NAME_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+POSTGRESQL_INSTALL = (
+    f'''
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}',
+                                  coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('{SEARCH_CONFIG}',
+                                     coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger
+    ON recipes_recipe
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector_update()
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx
+    ON recipes_recipe USING gin (search_vector)
+    ''',
+    '''
+    UPDATE recipes_recipe SET name = name WHERE search_vector IS NULL
+    ''',
+)
+
+POSTGRESQL_UNINSTALL = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_idx',
+    '''
+    DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger
+    ON recipes_recipe
+    ''',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()',
+)
+
+SQLITE_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+)
+
+SQLITE_UNINSTALL = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+)
+
+
+def install_search_index(connection):
+    """Создать поисковый индекс и триггеры, если их ещё нет.
+
+    На SQLite пересоздание таблицы рецептов в миграциях удаляет триггеры,
+    поэтому функция повторно вызывается после каждого migrate.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRESQL_INSTALL:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                "AND name LIKE 'recipes_recipe_fts_%'"
+            )
+            if cursor.fetchone()[0] == len(SQLITE_TRIGGERS):
+                return
+            cursor.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts '
+                "USING fts5(name, text, content='recipes_recipe', "
+                "content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            for statement in SQLITE_TRIGGERS:
+                cursor.execute(statement)
+            cursor.execute(
+                'INSERT INTO recipes_recipe_fts (recipes_recipe_fts) '
+                "VALUES ('rebuild')"
+            )
+
+
+def uninstall_search_index(connection):
+    """Удалить поисковый индекс и триггеры."""
+    statements = {
+        'postgresql': POSTGRESQL_UNINSTALL,
+        'sqlite': SQLITE_UNINSTALL,
+    }.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def search_recipes(queryset, query):
+    """Отфильтровать рецепты по запросу и упорядочить по релевантности."""
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-pub_date')
+    if vendor == 'sqlite':
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return queryset.none()
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(id__in=RawSQL(
+            'SELECT rowid FROM recipes_recipe_fts '
+            'WHERE recipes_recipe_fts MATCH %s',
+            (match,),
+        )).annotate(search_rank=RawSQL(
+            'SELECT -bm25(recipes_recipe_fts, %s, %s) '
+            'FROM recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s '
+            'AND rowid = recipes_recipe.id',
+            (NAME_WEIGHT, TEXT_WEIGHT, match),
+            output_field=FloatField(),
+        )).order_by('-search_rank', '-pub_date')
+    return queryset.filter(Q(name__icontains=query) | Q(text__icontains=query))
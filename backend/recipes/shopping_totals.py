@@ -0,0 +1,123 @@
+"""Итоги списков покупок, поддерживаемые по дельтам.
+
+Каждая операция с корзиной или с составом рецепта меняет строки
+``ShoppingListItem`` на разницу в количестве, поэтому выгрузка списка
+покупок — простое чтение по индексу без агрегации.
+"""
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import IngredientAmount, Recipe, ShoppingCart, ShoppingListItem
+
+
+def lock_recipe(recipe):
+    """Заблокировать рецепт до конца транзакции; False, если его нет.
+
+    Корзины и состав одного рецепта меняются по очереди, иначе дельта
+    посчитается по устаревшему составу или списку корзин. Блокировка
+    ``FOR NO KEY UPDATE`` не мешает вставке строк со ссылкой на рецепт.
+    """
+    return Recipe.objects.select_for_update(no_key=True).filter(
+        pk=recipe.pk
+    ).exists()
+
+
+def recipe_amounts(recipe):
+    """Количества ингредиентов рецепта вида {ingredient_id: amount}."""
+    return dict(
+        IngredientAmount.objects.filter(recipe=recipe)
+        .values_list('ingredient_id', 'amount')
+    )
+
+
+def apply_deltas(user_ids, deltas):
+    """Изменить итоги пользователей на {ingredient_id: delta}."""
+    user_ids = list(user_ids)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, total_amount=0
+            )
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ],
+        ignore_conflicts=True,
+    )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    )
+    items.update(total_amount=F('total_amount') + Case(
+        *(
+            When(ingredient_id=ingredient_id, then=Value(delta))
+            for ingredient_id, delta in deltas.items()
+        ),
+        default=Value(0),
+    ))
+    items.filter(total_amount=0).delete()
+
+
+def add_recipe(user, recipe):
+    """Учесть рецепт, добавленный в корзину."""
+    apply_deltas([user.id], recipe_amounts(recipe))
+
+
+def remove_recipe(user, recipe):
+    """Учесть рецепт, убранный из корзины."""
+    apply_deltas(
+        [user.id],
+        {
+            ingredient_id: -amount
+            for ingredient_id, amount in recipe_amounts(recipe).items()
+        },
+    )
+
+
+def remove_recipe_from_carts(recipe):
+    """Учесть удаление рецепта из корзин всех пользователей."""
+    apply_deltas(
+        ShoppingCart.objects.filter(recipe=recipe)
+        .values_list('user_id', flat=True),
+        {
+            ingredient_id: -amount
+            for ingredient_id, amount in recipe_amounts(recipe).items()
+        },
+    )
+
+
+def change_recipe(recipe, old_amounts, new_amounts):
+    """Учесть изменение состава рецепта в корзинах пользователей."""
+    deltas = {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    apply_deltas(
+        ShoppingCart.objects.filter(recipe=recipe)
+        .values_list('user_id', flat=True),
+        deltas,
+    )
+
+
+def rebuild(user_ids):
+    """Пересчитать итоги пользователей с нуля."""
+    user_ids = list(user_ids)
+    ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=row['recipe__cart__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total_amount'],
+        )
+        for row in IngredientAmount.objects.filter(
+            recipe__cart__user__in=user_ids
+        ).values('recipe__cart__user', 'ingredient').annotate(
+            total_amount=Sum('amount')
+        ).order_by()
+    )
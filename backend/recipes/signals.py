@@ -0,0 +1,135 @@
+from api.api_v1.authentication import invalidate_tokens, invalidate_users
+from api.api_v1.autocomplete import invalidate_ingredient_index
+from api.api_v1.cache import invalidate_tag_ids
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from users.models import Follow
+
+from . import shopping_totals
+from .images import discard_derivatives, refresh_derivatives
+from .models import (ContentVersion, Favorite, Ingredient, Recipe,
+                     ShoppingCart, Tags)
+
+User = get_user_model()
+
+AUTHOR_PUBLIC_FIELDS = frozenset(
+    ('email', 'username', 'first_name', 'last_name', 'avatar')
+)
+
+
+@receiver(post_save, sender=Tags)
+@receiver(pre_delete, sender=Tags)
+def touch_tag_recipes(sender, instance, **kwargs):
+    """Обновить версию рецептов с изменённым тегом."""
+    Recipe.objects.touch(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, **kwargs):
+    """Обновить версию рецептов с изменённым ингредиентом."""
+    Recipe.objects.touch(amount_ingredient__ingredient=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def reset_ingredient_index(sender, **kwargs):
+    """Перестроить индекс автодополнения ингредиентов."""
+    invalidate_ingredient_index()
+
+
+@receiver(post_save, sender=Tags)
+@receiver(post_delete, sender=Tags)
+def reset_tag_ids(sender, **kwargs):
+    """Сбросить кэш слагов тегов."""
+    invalidate_tag_ids()
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    """Обновить версию рецептов автора при изменении его профиля."""
+    if created:
+        return
+    if update_fields is not None and not (
+        AUTHOR_PUBLIC_FIELDS & set(update_fields)
+    ):
+        return
+    Recipe.objects.touch(author=instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_carts(sender, instance, **kwargs):
+    """Вычесть удаляемый рецепт из итогов покупок, в том числе каскадно."""
+    shopping_totals.lock_recipe(instance)
+    shopping_totals.remove_recipe_from_carts(instance)
+
+
+@receiver(pre_delete, sender=User)
+def release_user_counters(sender, instance, **kwargs):
+    """Уменьшить счётчики, которые каскадное удаление не затронет."""
+    Recipe.objects.filter(favorited_by__user=instance).update(
+        favorites_count=F('favorites_count') - 1,
+        updated_at=timezone.now(),
+    )
+    User.objects.filter(followers__user=instance).update(
+        followers_count=F('followers_count') - 1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipes_version(sender, **kwargs):
+    """Обновить версию списка рецептов."""
+    ContentVersion.objects.bump(ContentVersion.RECIPES)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_user_version(sender, instance, **kwargs):
+    """Обновить версию избранного, покупок и подписок пользователя."""
+    ContentVersion.objects.bump(ContentVersion.user_key(instance.user_id))
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_image(sender, instance, **kwargs):
+    """Построить копии нового изображения рецепта."""
+    refresh_derivatives(instance, 'image', {'pk': instance.pk})
+
+
+@receiver(post_save, sender=User)
+def refresh_avatar(sender, instance, **kwargs):
+    """Построить копии нового аватара."""
+    refresh_derivatives(instance, 'avatar', {'author_id': instance.pk})
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image_derivatives(sender, instance, **kwargs):
+    """Удалить копии изображения удалённого рецепта."""
+    discard_derivatives(instance, 'image')
+
+
+@receiver(post_delete, sender=User)
+def delete_avatar_derivatives(sender, instance, **kwargs):
+    """Удалить копии аватара удалённого пользователя."""
+    discard_derivatives(instance, 'avatar')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def reset_user(sender, instance, **kwargs):
+    """Сбросить кэш изменённого пользователя."""
+    invalidate_users([instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def reset_token(sender, instance, **kwargs):
+    """Сбросить кэш удалённого токена."""
+    invalidate_tokens([instance.key])
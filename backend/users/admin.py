@@ -5,7 +5,10 @@ from .models import Follow, MyUser
 
 @admin.register(MyUser)
 class MyUserAdmin(admin.ModelAdmin):
-    list_display = ('username', 'first_name', 'last_name', 'email')
+    list_display = (
+        'username', 'first_name', 'last_name', 'email',
+        'recipes_count', 'followers_count'
+    )
     search_fields = ('email', 'username')
 
 
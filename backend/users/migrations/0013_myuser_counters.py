@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 19:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_count(apps, schema_editor):
+    MyUser = apps.get_model('users', 'MyUser')
+    Follow = apps.get_model('users', 'Follow')
+    MyUser.objects.update(followers_count=Coalesce(Subquery(
+        Follow.objects.filter(following=OuterRef('pk')).order_by()
+        .values('following').annotate(count=Count('id')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_rename_avartar_myuser_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='myuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='myuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_followers_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_myuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='myuser',
+            name='avatar_variants',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Копии аватара'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 20:40
+
+from django.db import migrations
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_myuser_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='myuser',
+            managers=[
+                ('objects', users.models.MyUserManager()),
+            ],
+        ),
+    ]
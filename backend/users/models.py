@@ -1,8 +1,51 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
 
 
-class MyUser(AbstractUser):
+class CounterFieldsMixin:
+    """Денормализованные счётчики модели.
+
+    Счётчики меняются только атомарно через ``F()`` в ``update()``, поэтому
+    обычное сохранение объекта не перезаписывает их устаревшими значениями.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        """Сохранить объект, не трогая счётчики."""
+        if (
+            not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class MyUserQuerySet(models.QuerySet):
+    """Выборка пользователей."""
+
+    def update(self, **kwargs):
+        """Обновить пользователей и сбросить их строки в кэше."""
+        from api.api_v1.authentication import invalidate_users, users_cached
+
+        if not users_cached():
+            return super().update(**kwargs)
+        pks = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        invalidate_users(pks)
+        return rows
+
+
+class MyUserManager(UserManager.from_queryset(MyUserQuerySet)):
+    """Менеджер пользователей."""
+
+
+class MyUser(CounterFieldsMixin, AbstractUser):
     """Кастомная модель пользователя."""
 
     username = models.CharField(
@@ -29,6 +72,25 @@ class MyUser(AbstractUser):
         null=True,
         verbose_name='Аватар'
     )
+    avatar_variants = models.JSONField(
+        verbose_name='Копии аватара',
+        default=dict,
+        editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
+
+    objects = MyUserManager()
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']